@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+# benchmarks for the hot paths of solver.py, mcmc.py and generate.py
+#
+#   python benchmarks/run_benchmarks.py                  run everything, compare with the baseline
+#   python benchmarks/run_benchmarks.py -k likelihood    only the benchmarks whose name contains it
+#   python benchmarks/run_benchmarks.py --save-baseline  store this run as the new baseline
+#
+# every benchmark reports seconds per call (the fastest and the median of its runs); a benchmark
+# whose fastest time is more than --threshold slower than in the baseline is flagged as a
+# regression, and the script then exits with status 1
+# timings only compare between runs on the same machine, so the baseline records the machine
+# it was made on; save a new one after moving to another machine
+# everything runs offline on the CPU, with fixed seeds
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import generate
+import mcmc
+import solver
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, 'results.json')
+DEFAULT_THRESHOLD = 0.2
+
+# goal shapes, as the action sequences that build them
+SOLVER_GOALS = {
+    'zsazsar': 'ZSAZSAR',
+    'bar_center': 'XA',
+    'corner_flip': 'ZF',
+}
+# enumerate and pruned grow too slow to time repeatedly beyond these depths
+SOLVER_DEPTHS = {
+    'bfs': (4, 5, 6, 7),
+    'pruned': (4, 5, 6),
+    'enumerate': (4, 5),
+}
+SENTENCE_LENGTHS = (5, 10, 15, 20)
+TOKENS = ['l', 'r', 'm', 'f']
+
+DEMO_GRAMMAR = """
+S -> S S [0.5] | A [0.5]
+A -> 'a' [0.07692307692307693] | 'b' [0.07692307692307693] | 'c' [0.07692307692307693] | 'a' 'b' 'c' [0.7692307692307693]
+"""
+
+def random_sentences(length, count=10, seed=0):
+    rng = random.Random(seed)
+    return [[rng.choice(TOKENS) for _ in range(length)] for _ in range(count)]
+
+def library(seed=0, rules=16):
+    # the primitives plus random chunks of two to four tokens, like the grammars the chain visits
+    rng = random.Random(seed)
+    counts = {(token,): 1 for token in TOKENS}
+    while len(counts) < rules:
+        chunk = tuple(rng.choice(TOKENS) for _ in range(rng.randint(2, 4)))
+        counts[chunk] = counts.get(chunk, 0) + rng.randint(1, 3)
+    return mcmc.Grammar(counts)
+
+def solver_benchmarks():
+    for goal_name, sequence in SOLVER_GOALS.items():
+        goal = solver.get_shape_from_sequence(solver.convert_string(sequence))
+        for method, depths in SOLVER_DEPTHS.items():
+            for depth in depths:
+                name = f"solver/{method}/{goal_name}/depth={depth}"
+                params = {'method': method, 'goal': sequence, 'depth': depth}
+                yield name, params, 1, lambda goal=goal, depth=depth, method=method: solver.goal_solver(goal, max_depth=depth, method=method)
+
+def mcmc_benchmarks():
+    grammar = library()
+    for length in SENTENCE_LENGTHS:
+        sentences = random_sentences(length)
+        yield f"likelihood/length={length}", {'length': length, 'sentences': len(sentences)}, len(sentences), \
+            lambda sentences=sentences: mcmc.likelihood(grammar, sentences)
+
+    dictionary = mcmc.extract_terminals(grammar)
+    for length in SENTENCE_LENGTHS:
+        target = ''.join(random_sentences(length, count=1, seed=length)[0])
+        yield f"compute_probability/length={length}", {'length': length}, 1, \
+            lambda target=target: mcmc.compute_probability(target, dictionary, 0.4)
+
+    proposals = 1000
+
+    def propose():
+        random.seed(0)
+        for _ in range(proposals):
+            mcmc.proposal(grammar, len(TOKENS))
+
+    yield f"proposal/rules={len(grammar)}", {'rules': len(grammar), 'proposals': proposals}, proposals, propose
+
+def generate_benchmarks():
+    rules = generate.parse_grammar_string(DEMO_GRAMMAR)
+    sentences = 1000
+
+    def generate_sentences():
+        random.seed(0)
+        for _ in range(sentences):
+            generate.generate_sentence(rules, max_length=20)
+
+    yield "generate_sentence/max_length=20", {'max_length': 20, 'sentences': sentences}, sentences, generate_sentences
+
+    corpus_size = 100000
+    yield f"generate_corpus/n={corpus_size}", {'max_length': 20, 'sentences': corpus_size}, corpus_size, \
+        lambda: generate.generate_corpus(rules, corpus_size, max_length=20, seed=0)
+
+def benchmarks():
+    # (name, parameters, items per call, function) for every benchmark
+    yield from solver_benchmarks()
+    yield from mcmc_benchmarks()
+    yield from generate_benchmarks()
+
+def timed(function, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return time.perf_counter() - start
+
+def measure(function, repeat=3, min_time=0.2):
+    # seconds per call: the number of calls per run is doubled until a run takes min_time,
+    # then the run is repeated, and the fastest and the median are reported
+    number = 1
+    elapsed = timed(function, number)
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timed(function, number)
+    times = [elapsed] + [timed(function, number) for _ in range(repeat - 1)]
+    per_call = [t / number for t in times]
+    return {'best': min(per_call), 'median': statistics.median(per_call), 'calls': number, 'repeat': repeat}
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+def run(patterns=None, repeat=3, min_time=0.2):
+    results = {}
+    for name, params, items, function in benchmarks():
+        if patterns and not any(pattern in name for pattern in patterns):
+            continue
+        result = measure(function, repeat, min_time)
+        result['params'] = params
+        result['items_per_second'] = items / result['best']
+        results[name] = result
+        print(f"{name:45s} {result['best'] * 1000:12.3f} ms  {result['items_per_second']:14.1f} items/s", flush=True)
+    return {'machine': machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    # ratio of the fastest time to the baseline's for every benchmark in both, with a status:
+    # 'regression' above 1 + threshold, 'improvement' below 1 / (1 + threshold), else 'ok'
+    comparison = {}
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            comparison[name] = {'status': 'new'}
+            continue
+        ratio = result['best'] / baseline['results'][name]['best']
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comparison[name] = {'ratio': ratio, 'status': status}
+    return comparison
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the solver, mcmc and generate hot paths.")
+    parser.add_argument('-k', dest='patterns', action='append', help="only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument('--min-time', type=float, default=0.2, help="minimum seconds per timed run")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="where to write the JSON results")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="the JSON results to compare with")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="slowdown flagged as a regression (0.2 is 20%%)")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    report = run(args.patterns, args.repeat, args.min_time)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = {'machine': baseline['machine'], 'time': baseline['time'], 'threshold': args.threshold}
+        report['comparison'] = compare(report, baseline, args.threshold)
+        if baseline['machine'] != report['machine']:
+            print(f"note: the baseline was made on another machine ({baseline['machine']['platform']}), "
+                  "so the ratios are only indicative")
+        print()
+        for name, entry in report['comparison'].items():
+            if entry['status'] == 'new':
+                print(f"{name:45s} new")
+            else:
+                print(f"{name:45s} {entry['ratio']:6.2f}x  {entry['status']}")
+            if entry['status'] == 'regression':
+                regressions.append(name)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    if args.save_baseline:
+        saved = report
+        if args.patterns and os.path.exists(args.baseline):
+            # a partial run only replaces the benchmarks it ran
+            with open(args.baseline) as f:
+                saved = json.load(f)
+            saved['results'].update(report['results'])
+        with open(args.baseline, 'w') as f:
+            json.dump(saved, f, indent=2)
+        print(f"saved the baseline to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
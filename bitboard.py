@@ -0,0 +1,346 @@
+import functools
+import itertools
+
+from hex_geometry import AXIAL_TRANSFORMS, BOARD_SIZE, get_hex_geometry, hex_distance
+
+# a shape is stored as one Python int: bit i is set when the cell with index i is occupied
+# cells are indexed by their axial coordinates (q, r) inside a rhombus that is one cell wider
+# than the hexagon of the chosen radius around the center, so moving any cell of the hexagon
+# by one step never wraps around a row, and every move becomes a single shift of the int
+# the radius can be larger than the board, since shapes are allowed to leave it and come back
+
+DEFAULT_RADIUS = BOARD_SIZE
+
+offset_to_axial = get_hex_geometry(BOARD_SIZE).offset_to_axial
+axial_to_offset = get_hex_geometry(BOARD_SIZE).axial_to_offset
+
+class BitboardGeometry:
+    # precomputed tables for one window radius; get one through get_geometry
+
+    def __init__(self, radius):
+        self.radius = radius
+        self.pad = radius + 1
+        self.width = 2 * self.pad + 1
+
+        self.cell_of_bit = {}
+        self.inside = 0
+        for r in range(-radius, radius + 1):
+            for q in range(-radius, radius + 1):
+                if hex_distance(q, r) <= radius:
+                    bit = self.axial_bit(q, r)
+                    self.cell_of_bit[bit] = axial_to_offset(q, r)
+                    self.inside |= 1 << bit
+
+        # rotate and flip are permutations of the hexagon, stored per bit
+        self.rotate_table = {}
+        self.rotate_back_table = {}
+        self.flip_table = {}
+        for bit, (x, y) in self.cell_of_bit.items():
+            q, r = offset_to_axial(x, y)
+            self.rotate_table[bit] = self.axial_bit(*AXIAL_TRANSFORMS['rotate60'](q, r))
+            self.rotate_back_table[bit] = self.axial_bit(*AXIAL_TRANSFORMS['rotate_back'](q, r))
+            self.flip_table[bit] = self.axial_bit(*AXIAL_TRANSFORMS['flip_ne_to_sw'](q, r))
+
+        # the twelve symmetries of the hexagon about the center, as per-bit tables:
+        # symmetry k * 2 + j flips j times, then rotates k times
+        self.symmetry_tables = []
+        for k in range(6):
+            for j in range(2):
+                table = {}
+                for bit in self.cell_of_bit:
+                    image = self.flip_table[bit] if j else bit
+                    for _ in range(k):
+                        image = self.rotate_table[image]
+                    table[bit] = image
+                self.symmetry_tables.append(table)
+        # compose[g][h] is the symmetry that applies h, then g
+        self.compose = []
+        for g in self.symmetry_tables:
+            row = []
+            for h in self.symmetry_tables:
+                composed = {bit: g[h[bit]] for bit in self.cell_of_bit}
+                row.append(self.symmetry_tables.index(composed))
+            self.compose.append(row)
+
+        # translations are shifts of the whole int
+        self.west_shift = -1
+        self.northeast_shift = 1 - self.width
+        self.southeast_shift = self.width
+
+        cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
+        self.center = self.from_cells([(cx, cy)])
+        self.bar = self.from_cells([(cx - 1, cy - 1), (cx, cy), (cx + 1, cy)])
+        self.corner = self.from_cells([(cx + 1, cy - 1), (cx, cy), (cx, cy + 1)])
+
+        self.actions = {
+            'a': self.create_center,
+            'd': self.delete_center,
+            'z': self.add_corner,
+            'x': self.add_bar,
+            'w': self.move_west,
+            'e': self.move_northeast,
+            's': self.move_southeast,
+            'f': self.flip,
+            'r': self.reflect,
+            ' ': self.rotate,
+        }
+        # the cells that must be set in any image of each union action
+        self.added = {'a': self.center, 'x': self.bar, 'z': self.corner}
+
+        # inverses of the actions that are bijections
+        self.inverse_actions = {
+            'w': self.move_east,
+            'e': self.move_southwest,
+            's': self.move_northwest,
+            'f': self.flip,
+            ' ': self.rotate_back,
+        }
+
+    def axial_bit(self, q, r):
+        return (q + self.pad) + (r + self.pad) * self.width
+
+    def bit_of_cell(self, x, y):
+        q, r = offset_to_axial(x, y)
+        if hex_distance(q, r) > self.radius:
+            raise ValueError(f"cell {(x, y)} is outside the bitboard of radius {self.radius}")
+        return self.axial_bit(q, r)
+
+    def from_cells(self, cells):
+        mask = 0
+        for x, y in cells:
+            mask |= 1 << self.bit_of_cell(x, y)
+        return mask
+
+    def bits(self, mask):
+        # indices of the set bits, lowest first
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def to_cells(self, mask):
+        return [self.cell_of_bit[bit] for bit in self.bits(mask)]
+
+    def shift(self, mask, offset):
+        if offset >= 0:
+            mask <<= offset
+        else:
+            mask >>= -offset
+        if mask & ~self.inside:
+            raise ValueError(f"shape moved outside the bitboard of radius {self.radius}")
+        return mask
+
+    def permute(self, mask, table):
+        result = 0
+        for bit in self.bits(mask):
+            result |= 1 << table[bit]
+        return result
+
+    def create_center(self, mask):
+        return mask | self.center
+
+    def add_bar(self, mask):
+        return mask | self.bar
+
+    def add_corner(self, mask):
+        return mask | self.corner
+
+    def delete_center(self, mask):
+        return mask & ~self.center
+
+    def move_west(self, mask):
+        return self.shift(mask, self.west_shift)
+
+    def move_northeast(self, mask):
+        return self.shift(mask, self.northeast_shift)
+
+    def move_southeast(self, mask):
+        return self.shift(mask, self.southeast_shift)
+
+    def move_east(self, mask):
+        return self.shift(mask, -self.west_shift)
+
+    def move_southwest(self, mask):
+        return self.shift(mask, -self.northeast_shift)
+
+    def move_northwest(self, mask):
+        return self.shift(mask, -self.southeast_shift)
+
+    def rotate(self, mask):
+        return self.permute(mask, self.rotate_table)
+
+    def rotate_back(self, mask):
+        return self.permute(mask, self.rotate_back_table)
+
+    def flip(self, mask):
+        return self.permute(mask, self.flip_table)
+
+    def symmetry(self, mask, g):
+        return self.permute(mask, self.symmetry_tables[g])
+
+    def reflect(self, mask):
+        return mask | self.flip(mask)
+
+    def preimages(self, cmd, mask):
+        # every state the action maps onto mask (an empty list when there is none)
+        # the bijections have one; the unions and delete_center leave the cells they add or
+        # remove undetermined, and reflect leaves which side of each mirrored pair was there,
+        # so those have up to 2 ** 3 and 3 ** pairs preimages
+        if cmd in self.inverse_actions:
+            try:
+                return [self.inverse_actions[cmd](mask)]
+            except ValueError:
+                return []
+        if cmd in self.added:
+            added = self.added[cmd]
+            if mask & added != added:
+                return []
+            rest = mask & ~added
+            return [rest | subset for subset in self.subsets(added)]
+        if cmd == 'd':
+            if mask & self.center:
+                return []
+            return [mask, mask | self.center]
+        if cmd == 'r':
+            if self.flip(mask) != mask:
+                return []
+            fixed = 0
+            choices = [[0]]
+            for bit in self.bits(mask):
+                image = self.flip_table[bit]
+                if image == bit:
+                    fixed |= 1 << bit
+                elif bit < image:
+                    choices.append([1 << bit, 1 << image, 1 << bit | 1 << image])
+            result = []
+            for picked in itertools.product(*choices):
+                result.append(fixed | sum(picked))
+            return result
+        raise KeyError(cmd)
+
+    def subsets(self, mask):
+        # every subset of the set bits of mask
+        subset = mask
+        while True:
+            yield subset
+            if subset == 0:
+                return
+            subset = (subset - 1) & mask
+
+@functools.lru_cache(None)
+def get_geometry(radius=DEFAULT_RADIUS):
+    return BitboardGeometry(radius)
+
+class HexShape:
+    # immutable shape backed by a bitboard
+    # equality and hashing only look at the occupied cells, like check_goal does
+    # duplicated cells (e.g. add_bar over the center) are kept in `extra`, a sorted tuple of
+    # (bit, additional copies) pairs, so the list-of-tuples view still matches the list actions
+
+    __slots__ = ('geometry', 'mask', 'extra')
+
+    def __init__(self, mask=0, extra=(), geometry=None):
+        # the radius is passed explicitly, so this is the same cached geometry as from_cells'
+        self.geometry = geometry if geometry is not None else get_geometry(DEFAULT_RADIUS)
+        self.mask = mask
+        self.extra = extra
+
+    @classmethod
+    def from_cells(cls, cells, radius=DEFAULT_RADIUS):
+        geometry = get_geometry(radius)
+        mask = 0
+        extra = {}
+        for x, y in cells:
+            bit = geometry.bit_of_cell(x, y)
+            if mask >> bit & 1:
+                extra[bit] = extra.get(bit, 0) + 1
+            mask |= 1 << bit
+        return cls(mask, tuple(sorted(extra.items())), geometry)
+
+    def cells(self):
+        # list-of-tuples view, with duplicated cells repeated
+        extra = dict(self.extra)
+        result = []
+        for bit in self.geometry.bits(self.mask):
+            result.extend([self.geometry.cell_of_bit[bit]] * (1 + extra.get(bit, 0)))
+        return result
+
+    def __len__(self):
+        return len(self.cells())
+
+    def __eq__(self, other):
+        if isinstance(other, HexShape):
+            return self.mask == other.mask and self.geometry is other.geometry
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def __repr__(self):
+        return f"HexShape({self.cells()})"
+
+    def _added(self, added):
+        # extra copies appear wherever the added cells were already occupied
+        extra = dict(self.extra)
+        for bit in self.geometry.bits(self.mask & added):
+            extra[bit] = extra.get(bit, 0) + 1
+        return HexShape(self.mask | added, tuple(sorted(extra.items())), self.geometry)
+
+    def _moved(self, mask, bit_map):
+        extra = tuple(sorted((bit_map(bit), count) for bit, count in self.extra))
+        return HexShape(mask, extra, self.geometry)
+
+    def _shifted(self, offset):
+        return self._moved(self.geometry.shift(self.mask, offset), lambda bit: bit + offset)
+
+    def create_center(self):
+        return self._added(self.geometry.center)
+
+    def add_bar(self):
+        return self._added(self.geometry.bar)
+
+    def add_corner(self):
+        return self._added(self.geometry.corner)
+
+    def delete_center(self):
+        # every copy of the center goes, like the list version's while loop
+        center_bit = self.geometry.center.bit_length() - 1
+        extra = tuple((bit, count) for bit, count in self.extra if bit != center_bit)
+        return HexShape(self.geometry.delete_center(self.mask), extra, self.geometry)
+
+    def move_west(self):
+        return self._shifted(self.geometry.west_shift)
+
+    def move_northeast(self):
+        return self._shifted(self.geometry.northeast_shift)
+
+    def move_southeast(self):
+        return self._shifted(self.geometry.southeast_shift)
+
+    def rotate(self):
+        table = self.geometry.rotate_table
+        return self._moved(self.geometry.rotate(self.mask), table.__getitem__)
+
+    def flip(self):
+        table = self.geometry.flip_table
+        return self._moved(self.geometry.flip(self.mask), table.__getitem__)
+
+    def reflect(self):
+        # the list version goes through a set, so duplicates are dropped
+        return HexShape(self.geometry.reflect(self.mask), (), self.geometry)
+
+    def apply(self, cmd):
+        return getattr(self, ACTION_NAMES[cmd])()
+
+ACTION_NAMES = {
+    'a': 'create_center',
+    'd': 'delete_center',
+    'z': 'add_corner',
+    'x': 'add_bar',
+    'w': 'move_west',
+    'e': 'move_northeast',
+    's': 'move_southeast',
+    'f': 'flip',
+    'r': 'reflect',
+    ' ': 'rotate',
+}
@@ -0,0 +1,149 @@
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+# an on-disk corpus of token sequences, written by generate.py and read by mcmc.py
+#
+# layout of a corpus directory:
+#   tokens.bin       the token ids of every sentence, back to back (little-endian int32)
+#   offsets.bin      n + 1 positions in tokens.bin (little-endian int64): sentence i is
+#                    tokens[offsets[i]:offsets[i + 1]]
+#   vocabulary.json  the format version and the token strings, indexed by id
+#
+# both arrays are memory-mapped, so a corpus larger than memory can be read, and a sentence
+# is a slice of the token array rather than a copy; vocabulary.json is written last, so a
+# directory without it is an unfinished corpus
+
+VERSION = 1
+TOKEN_DTYPE = np.dtype('<i4')
+OFFSET_DTYPE = np.dtype('<i8')
+
+class CorpusWriter:
+    # appends sentences to a new corpus directory; use it as a context manager, or call close()
+    # sentences are buffered and written out every buffer_size tokens
+
+    def __init__(self, path, buffer_size=1 << 20):
+        os.makedirs(path, exist_ok=True)
+        # an overwritten corpus stops being marked finished before its arrays are truncated
+        if is_corpus(path):
+            os.remove(os.path.join(path, 'vocabulary.json'))
+        self.path = path
+        self.buffer_size = buffer_size
+        self.vocabulary = []
+        self.token_ids = {}
+        self.tokens_file = open(os.path.join(path, 'tokens.bin'), 'wb')
+        self.offsets_file = open(os.path.join(path, 'offsets.bin'), 'wb')
+        self.offsets_file.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+        self.num_tokens = 0
+        self.num_sentences = 0
+        self.tokens = []
+        self.offsets = []
+
+    def token_id(self, token):
+        if token not in self.token_ids:
+            self.token_ids[token] = len(self.vocabulary)
+            self.vocabulary.append(token)
+        return self.token_ids[token]
+
+    def add(self, sentence):
+        # one sentence, as any iterable of token strings
+        self.tokens.extend(self.token_id(token) for token in sentence)
+        self.offsets.append(self.num_tokens + len(self.tokens))
+        self.num_sentences += 1
+        if len(self.tokens) >= self.buffer_size:
+            self.flush()
+
+    def add_arrays(self, ids, offsets, vocabulary):
+        # many sentences at once, as the flat ids, offsets and vocabulary of
+        # generate.sample_derivations, without going through Python lists
+        self.flush()
+        remap = np.array([self.token_id(token) for token in vocabulary], dtype=TOKEN_DTYPE)
+        self.tokens_file.write(remap[ids].astype(TOKEN_DTYPE).tobytes())
+        self.offsets_file.write((np.asarray(offsets[1:]) + self.num_tokens).astype(OFFSET_DTYPE).tobytes())
+        self.num_tokens += int(offsets[-1])
+        self.num_sentences += len(offsets) - 1
+
+    def flush(self):
+        self.tokens_file.write(np.array(self.tokens, dtype=TOKEN_DTYPE).tobytes())
+        self.offsets_file.write(np.array(self.offsets, dtype=OFFSET_DTYPE).tobytes())
+        self.num_tokens += len(self.tokens)
+        self.tokens = []
+        self.offsets = []
+
+    def close(self, finished=True):
+        # finished=False only closes the files, leaving the corpus unfinished
+        self.flush()
+        self.tokens_file.close()
+        self.offsets_file.close()
+        if not finished:
+            return
+        with open(os.path.join(self.path, 'vocabulary.json'), 'w') as f:
+            json.dump({'version': VERSION, 'vocabulary': self.vocabulary}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a write interrupted by an exception is never marked finished
+        self.close(finished=exc_type is None)
+
+def write_corpus(path, sentences):
+    # a corpus from any iterable of sentences, streamed to disk
+    with CorpusWriter(path) as writer:
+        for sentence in sentences:
+            writer.add(sentence)
+
+def is_corpus(path):
+    return os.path.isfile(os.path.join(path, 'vocabulary.json'))
+
+class Corpus:
+    # read-only, memory-mapped view of a corpus directory
+    # corpus[i] is sentence i as a zero-copy array of token ids; iterating gives the sentences
+    # as lists of token strings, like the hand-written corpora in mcmc.py
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'vocabulary.json')) as f:
+            header = json.load(f)
+        if header['version'] != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} corpus")
+        self.path = path
+        self.vocabulary = header['vocabulary']
+        self.offsets = np.memmap(os.path.join(path, 'offsets.bin'), dtype=OFFSET_DTYPE, mode='r')
+        if self.offsets[-1]:
+            self.tokens = np.memmap(os.path.join(path, 'tokens.bin'), dtype=TOKEN_DTYPE, mode='r')
+        else:
+            # numpy cannot map an empty file
+            self.tokens = np.zeros(0, dtype=TOKEN_DTYPE)
+        self._counts = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        vocabulary = self.vocabulary
+        for i in range(len(self)):
+            yield [vocabulary[token] for token in self[i].tolist()]
+
+    def counts(self, chunk_size=1 << 16):
+        # the unique sentences (tuples of token strings) and their multiplicities, as
+        # mcmc.count_sentences gives them; sentences are grouped by the bytes of their slices,
+        # so only the unique ones are ever turned into strings
+        # the offsets are read chunk_size sentences at a time, and each chunk's tokens are one
+        # slice of the mapped array, so memory only grows with the number of unique sentences
+        if self._counts is None:
+            grouped = Counter()
+            for first in range(0, len(self), chunk_size):
+                offsets = np.asarray(self.offsets[first:first + chunk_size + 1])
+                tokens = self.tokens[offsets[0]:offsets[-1]]
+                starts = offsets[:-1] - offsets[0]
+                ends = offsets[1:] - offsets[0]
+                grouped.update(tokens[start:end].tobytes() for start, end in zip(starts, ends))
+            vocabulary = self.vocabulary
+            self._counts = Counter({tuple(vocabulary[token] for token in np.frombuffer(key, dtype=TOKEN_DTYPE).tolist()): count
+                                    for key, count in grouped.items()})
+        return self._counts
@@ -1,6 +1,10 @@
 import random
 import re
+import sys
 from collections import defaultdict
+from functools import lru_cache
+import numpy as np
+from corpus import CorpusWriter
 
 def parse_grammar_string(grammar_str):
     rules = defaultdict(list)
@@ -19,18 +23,25 @@ def parse_grammar_string(grammar_str):
             rules[lhs].append((rhs_symbols, weight))
     return rules
 
-def generate_sentence(rules, start_symbol="S", max_depth=50, max_length=20):
-    def expand(symbol, depth=0):
-        nonlocal token_count
-        if depth > max_depth or token_count >= max_length:
-            return []
+def iter_sentence(rules, start_symbol="S", max_depth=50, max_length=20):
+    # yields the tokens of one sentence as they are derived, expanding the leftmost symbol first
+    # with an explicit stack of (symbol, depth), so S -> S S never builds a deep call stack
+    # symbols deeper than max_depth are dropped, and the sentence stops as soon as it has
+    # max_length tokens
+    stack = [(start_symbol, 0)]
+    token_count = 0
+    while stack and token_count < max_length:
+        symbol, depth = stack.pop()
+        if depth > max_depth:
+            continue
         if symbol.startswith("'") and symbol.endswith("'"):
-            token = symbol.strip("'")
             token_count += 1
-            return [token]
+            yield symbol.strip("'")
+            continue
         if symbol not in rules:
-            return [symbol]
-        
+            yield symbol
+            continue
+
         rhs_options = []
         adjusted_weights = []
         for rhs, weight in rules[symbol]:
@@ -43,22 +54,241 @@ def generate_sentence(rules, start_symbol="S", max_depth=50, max_length=20):
             adjusted_weights = [w for _, w in rules[symbol]]
 
         chosen_rhs = random.choices(rhs_options, weights=adjusted_weights)[0]
-        result = []
-        for sym in chosen_rhs:
-            result.extend(expand(sym, depth + 1))
-            if token_count >= max_length:
-                break
-        return result
+        # pushed in reverse, so the leftmost symbol is expanded first
+        for sym in reversed(chosen_rhs):
+            stack.append((sym, depth + 1))
 
-    token_count = 0
-    return expand(start_symbol)
+def generate_sentence(rules, start_symbol="S", max_depth=50, max_length=20):
+    # one sentence as a list of tokens; the same random state gives the same sentence as the
+    # recursive expansion this replaced
+    return list(iter_sentence(rules, start_symbol, max_depth, max_length))
+
+def compile_rules(rules, start_symbol="S"):
+    # the rules as arrays, with every symbol turned into an integer code:
+    # nonterminals (the left-hand sides) are 0 .. len(nonterminals) - 1 and every other symbol
+    # is len(nonterminals) + its index in the vocabulary of emitted symbols
+    # returns the code of the start symbol, the vocabulary, whether each vocabulary entry counts
+    # towards max_length and, per nonterminal, the right-hand sides as code arrays, their
+    # weights and their terminal counts
+    nonterminals = list(rules)
+    nonterminal_ids = {symbol: i for i, symbol in enumerate(nonterminals)}
+    vocabulary = []
+    vocabulary_ids = {}
+    counts_token = []
+
+    def code(symbol):
+        if symbol in nonterminal_ids:
+            return nonterminal_ids[symbol]
+        # a quoted terminal is emitted without its quotes and counts towards max_length;
+        # an unknown symbol is emitted as it is and does not
+        is_terminal = symbol.startswith("'") and symbol.endswith("'")
+        text = symbol.strip("'") if is_terminal else symbol
+        if (text, is_terminal) not in vocabulary_ids:
+            vocabulary_ids[(text, is_terminal)] = len(vocabulary)
+            vocabulary.append(text)
+            counts_token.append(is_terminal)
+        return len(nonterminals) + vocabulary_ids[(text, is_terminal)]
+
+    tables = []
+    for symbol in nonterminals:
+        rhs_codes = [np.array([code(s) for s in rhs], dtype=np.int64) for rhs, _ in rules[symbol]]
+        weights = np.array([weight for _, weight in rules[symbol]])
+        rhs_lens = np.array([sum(1 for s in rhs if s.startswith("'")) for rhs, _ in rules[symbol]])
+        tables.append((rhs_codes, weights, rhs_lens))
+    return code(start_symbol), vocabulary, np.array(counts_token, dtype=np.int64), tables
+
+def sample_derivations(rules, n, max_length=20, seed=None, start_symbol="S", max_depth=50):
+    # n derivations expanded side by side with NumPy, with the semantics of generate_sentence:
+    # left-to-right expansion, symbols deeper than max_depth dropped, the 0.1 penalty on a
+    # right-hand side that would take the sentence past max_length, and a derivation stopping
+    # as soon as it reaches max_length terminals
+    # every derivation keeps its own stack of (symbol code, depth) in a row of an array; each
+    # round pops one symbol from every unfinished derivation, and all the derivations that
+    # expand the same nonterminal draw their right-hand sides together from the
+    # cumulative-weight table of that nonterminal
+    # returns the emitted symbol ids of all the sentences in one flat array, the offsets of
+    # the sentences in it (sentence i is ids[offsets[i]:offsets[i + 1]]) and the vocabulary
+    # seed can also be a NumPy Generator, to continue its stream
+    rng = np.random.default_rng(seed)
+    start, vocabulary, counts_token, tables = compile_rules(rules, start_symbol)
+    num_nonterminals = len(tables)
+    max_rhs = max((len(rhs) for rhs_codes, _, _ in tables for rhs in rhs_codes), default=1)
+
+    stack_capacity = 4 * max_rhs
+    stack = np.zeros((n, stack_capacity), dtype=np.int64)
+    depth = np.zeros((n, stack_capacity), dtype=np.int64)
+    stack_size = np.zeros(n, dtype=np.int64)
+    output_capacity = max_length + 1
+    output = np.zeros((n, output_capacity), dtype=np.int64)
+    output_size = np.zeros(n, dtype=np.int64)
+    token_count = np.zeros(n, dtype=np.int64)
+
+    stack[:, 0] = start
+    stack_size[:] = 1
+
+    unfinished = np.arange(n)
+    while True:
+        unfinished = unfinished[(stack_size[unfinished] > 0) & (token_count[unfinished] < max_length)]
+        if len(unfinished) == 0:
+            break
+        stack_size[unfinished] -= 1
+        symbols = stack[unfinished, stack_size[unfinished]]
+        depths = depth[unfinished, stack_size[unfinished]]
+        kept = depths <= max_depth
+        active, symbols, depths = unfinished[kept], symbols[kept], depths[kept]
 
-grammar_text = """
+        emitting = symbols >= num_nonterminals
+        rows = active[emitting]
+        if len(rows):
+            if output_size[rows].max() >= output_capacity:
+                output = np.concatenate([output, np.zeros_like(output)], axis=1)
+                output_capacity *= 2
+            emitted = symbols[emitting] - num_nonterminals
+            output[rows, output_size[rows]] = emitted
+            output_size[rows] += 1
+            token_count[rows] += counts_token[emitted]
+
+        expanding = ~emitting
+        if not expanding.any():
+            continue
+        if stack_size[active[expanding]].max() + max_rhs > stack_capacity:
+            stack = np.concatenate([stack, np.zeros_like(stack)], axis=1)
+            depth = np.concatenate([depth, np.zeros_like(depth)], axis=1)
+            stack_capacity *= 2
+        for nonterminal in np.unique(symbols[expanding]):
+            group = expanding & (symbols == nonterminal)
+            rows = active[group]
+            child_depth = depths[group] + 1
+            rhs_codes, weights, rhs_lens = tables[nonterminal]
+            penalty = np.where(token_count[rows, None] + rhs_lens[None, :] <= max_length, 1.0, 0.1)
+            cumulative = np.cumsum(weights[None, :] * penalty, axis=1)
+            draws = rng.random(len(rows)) * cumulative[:, -1]
+            choices = (cumulative <= draws[:, None]).sum(axis=1)
+            for option, rhs in enumerate(rhs_codes):
+                chosen = choices == option
+                if not chosen.any():
+                    continue
+                option_rows = rows[chosen]
+                # pushed in reverse, so the leftmost symbol is popped first
+                for k, symbol in enumerate(rhs[::-1]):
+                    stack[option_rows, stack_size[option_rows] + k] = symbol
+                    depth[option_rows, stack_size[option_rows] + k] = child_depth[chosen]
+                stack_size[option_rows] += len(rhs)
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(output_size, out=offsets[1:])
+    ids = output[np.arange(output_capacity)[None, :] < output_size[:, None]]
+    return ids, offsets, vocabulary
+
+def write_generated_corpus(path, rules, n, max_length=20, seed=None, start_symbol="S", max_depth=50, batch_size=100000):
+    # n sentences drawn like generate_corpus, streamed to a corpus directory (see corpus.py) in
+    # batches of batch_size, so the corpus never has to fit in memory
+    rng = np.random.default_rng(seed)
+    with CorpusWriter(path) as writer:
+        for start in range(0, n, batch_size):
+            batch = min(batch_size, n - start)
+            writer.add_arrays(*sample_derivations(rules, batch, max_length, rng, start_symbol, max_depth))
+
+def generate_corpus(rules, n, max_length=20, seed=None, start_symbol="S", max_depth=50):
+    # n sentences (lists of tokens) with the distribution of generate_sentence, drawn in bulk by
+    # sample_derivations; the same seed always gives the same corpus
+    ids, offsets, vocabulary = sample_derivations(rules, n, max_length, seed, start_symbol, max_depth)
+    tokens = [vocabulary[i] for i in ids.tolist()]
+    return [tokens[offsets[i]:offsets[i + 1]] for i in range(n)]
+
+def shortest_lengths(rules):
+    # the fewest tokens each nonterminal can derive (absent when it derives no finite string)
+    shortest = {}
+    changed = True
+    while changed:
+        changed = False
+        for lhs, options in rules.items():
+            for rhs, _ in options:
+                if all(s in shortest or s not in rules for s in rhs):
+                    length = sum(shortest.get(s, 1) for s in rhs)
+                    if length < shortest.get(lhs, length + 1):
+                        shortest[lhs] = length
+                        changed = True
+    return shortest
+
+def string_distribution(rules, max_length, start_symbol="S"):
+    # the exact probability of every string of at most max_length tokens under the rules, read
+    # as a PCFG (each nonterminal's weights normalised, no depth or length penalty), as a sparse
+    # {tuple of tokens: probability} dict of the strings that can be derived
+    # this is the unpenalised PCFG, not generate_sentence's distribution: its 0.1 penalty on a
+    # right-hand side that would pass max_length also renormalises the alternatives that fit,
+    # so it changes the probability of strings well below max_length too; no penalty can fire
+    # while token_count + the longest right-hand side <= max_length, so the two agree on the
+    # strings of at most max_length - (the most terminals in one right-hand side) tokens, as
+    # long as max_depth is never reached
+    # strings(symbol, n) is the distribution of the strings of exactly n tokens derived from
+    # symbol, and sequence_strings(rhs, n) that of a right-hand side, both memoised, so every
+    # (nonterminal, length) pair is expanded once however many derivations share it
+    # a symbol without rules is a token, with its quotes removed if it has them
+    # a grammar where a nonterminal can derive itself without adding a token has infinitely
+    # many derivations per string, and raises ValueError
+    options = {}
+    for lhs, rhs_options in rules.items():
+        total = sum(weight for _, weight in rhs_options)
+        options[lhs] = [(tuple(rhs), weight / total) for rhs, weight in rhs_options if weight > 0]
+    shortest = shortest_lengths(rules)
+
+    def shortest_length(symbols):
+        return sum(shortest.get(s, max_length + 1) if s in options else 1 for s in symbols)
+
+    in_progress = set()
+
+    @lru_cache(None)
+    def strings(symbol, n):
+        if symbol not in options:
+            token = symbol.strip("'") if symbol.startswith("'") and symbol.endswith("'") else symbol
+            return {(token,): 1.0} if n == 1 else {}
+        if (symbol, n) in in_progress:
+            raise ValueError(f"{symbol} can derive itself without adding a token")
+        in_progress.add((symbol, n))
+        result = defaultdict(float)
+        for rhs, probability in options[symbol]:
+            for string, string_probability in sequence_strings(rhs, n).items():
+                result[string] += probability * string_probability
+        in_progress.discard((symbol, n))
+        return dict(result)
+
+    @lru_cache(None)
+    def sequence_strings(rhs, n):
+        if not rhs:
+            return {(): 1.0} if n == 0 else {}
+        result = defaultdict(float)
+        # the first symbol takes k tokens, leaving enough for the shortest strings of the rest
+        for k in range(shortest_length(rhs[:1]), n - shortest_length(rhs[1:]) + 1):
+            first = strings(rhs[0], k)
+            if not first:
+                continue
+            rest = sequence_strings(rhs[1:], n - k)
+            for head, head_probability in first.items():
+                for tail, tail_probability in rest.items():
+                    result[head + tail] += head_probability * tail_probability
+        return dict(result)
+
+    distribution = {}
+    for n in range(max_length + 1):
+        distribution.update(strings(start_symbol, n))
+    return distribution
+
+def main(corpus_path=None, n=10000):
+    # prints 10 sentences, or with a path (python generate.py corpus_dir [n]) writes n sentences
+    # to a corpus directory that mcmc.py can read with --corpus=corpus_dir
+    grammar_text = """
 S -> S S [0.5] | A [0.5]
 A -> 'a' [0.07692307692307693] | 'b' [0.07692307692307693] | 'c' [0.07692307692307693] | 'a' 'b' 'c' [0.7692307692307693]
 """
 
-rules = parse_grammar_string(grammar_text)
-for _ in range(10):
-    sentence = generate_sentence(rules, max_length=10)
-    print("".join(sentence))
\ No newline at end of file
+    rules = parse_grammar_string(grammar_text)
+    if corpus_path is not None:
+        write_generated_corpus(corpus_path, rules, int(n), max_length=10, seed=0)
+        return
+    for _ in range(10):
+        sentence = generate_sentence(rules, max_length=10)
+        print("".join(sentence))
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
\ No newline at end of file
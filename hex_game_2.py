@@ -1,7 +1,15 @@
 import os
 
+from hex_geometry import get_hex_geometry
+
 BOARD_SIZE = 9
 
+geometry = get_hex_geometry(BOARD_SIZE)
+offset_to_axial = geometry.offset_to_axial
+axial_to_offset = geometry.axial_to_offset
+rotate60 = geometry.rotate60
+flip_nw_to_se = geometry.flip_nw_to_se
+
 GOAL_SHAPE = [(BOARD_SIZE // 2, BOARD_SIZE // 2), (BOARD_SIZE // 2, BOARD_SIZE // 2 + 1)]
 
 def check_goal(current_shapes, goal_shape):
@@ -64,71 +72,19 @@ def delete_center(shapes):
     return shapes
 
 def move_west(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            shape[i] = (x, y - 1)
-    return shapes
-
-def offset_to_axial(x, y):
-    if x <= BOARD_SIZE // 2:
-        q = y - x
-    else:
-        q = y - BOARD_SIZE // 2
-    r = x - BOARD_SIZE // 2
-    return q, r
-
-def axial_to_offset(q, r):
-    x = r + BOARD_SIZE // 2
-    if x <= BOARD_SIZE // 2:
-        y = q + r + BOARD_SIZE // 2
-    else:
-        y = q + BOARD_SIZE // 2
-    return x, y
-
-def axial_to_cube(q, r):
-    x = q
-    z = r
-    y = -x - z
-    return (x, y, z)
-
-def cube_to_axial(x, y, z):
-    q = x
-    r = z
-    return (q, r)
-
-def rotate60(a, b):
-    q, r = offset_to_axial(a, b)
-    x, y, z = axial_to_cube(q, r)
-    x, y, z = -z, -x, -y
-
-    return axial_to_offset(*cube_to_axial(x, y, z))
-
-def flip_nw_to_se(a, b):
-    # the axis is q = 0 in axial coordinates
-    q, r = offset_to_axial(a, b)
-
-    return axial_to_offset(-q, q + r)
+    return geometry.transform_shapes(shapes, 'move_west')
 
 def rotate(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            shape[i] = rotate60(x, y)
-    return shapes
+    return geometry.transform_shapes(shapes, 'rotate60')
 
 def flip(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            shape[i] = flip_nw_to_se(x, y)
-    return shapes
+    return geometry.transform_shapes(shapes, 'flip_nw_to_se')
 
 def reflect(shapes):
     reflected_shapes = []
     for shape in shapes:
         original = shape[:]
-        flipped = [flip_nw_to_se(x, y) for (x, y) in shape]
+        flipped = geometry.transform(shape, 'flip_nw_to_se')
         combined = list(set(original + flipped))
         reflected_shapes.append(combined)
     return reflected_shapes
@@ -0,0 +1,133 @@
+import functools
+
+# shared hex-board geometry for the hex games, the solver and the bitboards
+# cells are (x, y) offset coordinates on a BOARD_SIZE hexagonal board; the center is
+# (BOARD_SIZE // 2, BOARD_SIZE // 2), which is (0, 0) in axial coordinates
+
+BOARD_SIZE = 9
+
+def compute_offset_to_axial(x, y, board_size):
+    if x <= board_size // 2:
+        q = y - x
+    else:
+        q = y - board_size // 2
+    r = x - board_size // 2
+    return q, r
+
+def compute_axial_to_offset(q, r, board_size):
+    x = r + board_size // 2
+    if x <= board_size // 2:
+        y = q + r + board_size // 2
+    else:
+        y = q + board_size // 2
+    return x, y
+
+def axial_to_cube(q, r):
+    x = q
+    z = r
+    y = -x - z
+    return (x, y, z)
+
+def cube_to_axial(x, y, z):
+    q = x
+    r = z
+    return (q, r)
+
+def hex_distance(q, r):
+    # number of steps from the center in axial coordinates
+    return max(abs(q), abs(r), abs(q + r))
+
+# every cell transform as a map on axial coordinates
+AXIAL_TRANSFORMS = {
+    # 60 degrees, through cube coordinates: (x, y, z) -> (-z, -x, -y)
+    'rotate60': lambda q, r: (-r, q + r),
+    'rotate_back': lambda q, r: (q + r, -q),
+    # the axis is q = 0 in axial coordinates
+    'flip_nw_to_se': lambda q, r: (-q, q + r),
+    'flip_ne_to_sw': lambda q, r: (q, -q - r),
+    'move_west': lambda q, r: (q - 1, r),
+    'move_east': lambda q, r: (q + 1, r),
+    'move_northeast': lambda q, r: (q + 1, r - 1),
+    'move_southwest': lambda q, r: (q - 1, r + 1),
+    'move_southeast': lambda q, r: (q, r + 1),
+    'move_northwest': lambda q, r: (q, r - 1),
+}
+
+class CellTable(dict):
+    # a lookup table filled up front for a window of cells
+    # cells further away (shapes can leave the board, so coordinates can go negative)
+    # are computed the first time they are asked for and then stored as well
+
+    def __init__(self, function, cells):
+        super().__init__((cell, function(*cell)) for cell in cells)
+        self.function = function
+
+    def __missing__(self, cell):
+        value = self[cell] = self.function(*cell)
+        return value
+
+class HexGeometry:
+    # lookup tables for one board size; get one through get_hex_geometry
+    # the tables cover every cell within `margin` steps of the board, so the usual
+    # transforms cost one dictionary lookup per cell
+
+    def __init__(self, board_size, margin=None):
+        self.board_size = board_size
+        if margin is None:
+            margin = board_size
+        radius = board_size // 2 + margin
+
+        axial_cells = [(q, r) for r in range(-radius, radius + 1) for q in range(-radius, radius + 1)
+                       if hex_distance(q, r) <= radius]
+        self.axial_to_offset_table = CellTable(
+            lambda q, r: compute_axial_to_offset(q, r, board_size), axial_cells)
+        offset_cells = list(self.axial_to_offset_table.values())
+        self.offset_to_axial_table = CellTable(
+            lambda x, y: compute_offset_to_axial(x, y, board_size), offset_cells)
+
+        self.tables = {}
+        for name, transform in AXIAL_TRANSFORMS.items():
+            self.tables[name] = CellTable(self.offset_transform(transform), offset_cells)
+
+    def offset_transform(self, transform):
+        def function(x, y):
+            q, r = compute_offset_to_axial(x, y, self.board_size)
+            return compute_axial_to_offset(*transform(q, r), self.board_size)
+        return function
+
+    # per-cell lookups, with the same signatures as the original functions
+
+    def offset_to_axial(self, x, y):
+        return self.offset_to_axial_table[(x, y)]
+
+    def axial_to_offset(self, q, r):
+        return self.axial_to_offset_table[(q, r)]
+
+    def rotate60(self, a, b):
+        return self.tables['rotate60'][(a, b)]
+
+    def flip_nw_to_se(self, a, b):
+        return self.tables['flip_nw_to_se'][(a, b)]
+
+    def flip_ne_to_sw(self, a, b):
+        return self.tables['flip_ne_to_sw'][(a, b)]
+
+    # whole-shape transforms
+    # shapes are short lists of (x, y) tuples, so one dictionary lookup per cell is faster here
+    # than converting them to and from NumPy arrays
+
+    def transform(self, shape, name):
+        # the image of every cell of the shape, in the same order
+        table = self.tables[name]
+        return [table[cell] for cell in shape]
+
+    def transform_shapes(self, shapes, name):
+        # apply a transform in place to a list of shapes, like the game actions do
+        table = self.tables[name]
+        for shape in shapes:
+            shape[:] = [table[cell] for cell in shape]
+        return shapes
+
+@functools.lru_cache(None)
+def get_hex_geometry(board_size=BOARD_SIZE):
+    return HexGeometry(board_size)
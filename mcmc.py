@@ -2,10 +2,17 @@ from nltk import PCFG
 from nltk.parse import ChartParser
 import random
 import math
+import sys
+import os
+import json
+import pickle
 from tqdm.auto import tqdm
-import copy
 from functools import lru_cache
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from nltk.parse.generate import generate
+import numpy as np
+from corpus import Corpus, is_corpus
 
 def clean_text(s):
         # clean "... [xx]" to (..., xx)
@@ -14,13 +21,224 @@ def clean_text(s):
         text2 = text_list[1].strip(']').strip()
         return text1, float(text2)
 
+# every distinct rule tuple is kept once, so grammars share their rule objects
+INTERNED_RULES = {}
+
+def intern_rule(rule):
+    rule = tuple(sys.intern(symbol) for symbol in rule)
+    return INTERNED_RULES.setdefault(rule, rule)
+
+def parse_rule(rule):
+    # "A -> 'l' 'r'" to ('l', 'r')
+    rhs = rule.split("->")[1].strip()
+    return tuple(s.strip("'") for s in rhs.split())
+
+def rule_string(rule):
+    # ('l', 'r') to "A -> 'l' 'r'"
+    return "A -> " + " ".join(f"'{symbol}'" for symbol in rule)
+
+class WeightedSampler:
+    # items with integer weights in a Fenwick tree, for O(log n) updates and draws
+    # an item whose weight drops to 0 keeps its slot, so the order of the others never
+    # changes; sample() then picks exactly what random.choice would pick from a list holding
+    # every item `weight` times in that order, for the same random state
+    # the slots are compacted once more than half of them are empty
+
+    __slots__ = ('tree', 'items', 'index', 'total', 'empty')
+
+    def __init__(self, weights=()):
+        self.tree = [0]
+        self.items = []
+        self.index = {}
+        self.total = 0
+        self.empty = 0
+        for item, weight in weights:
+            self.append(item, weight)
+
+    def copy(self):
+        sampler = WeightedSampler.__new__(WeightedSampler)
+        sampler.tree = self.tree[:]
+        sampler.items = self.items[:]
+        sampler.index = dict(self.index)
+        sampler.total = self.total
+        sampler.empty = self.empty
+        return sampler
+
+    def prefix(self, i):
+        # total weight of the first i slots
+        result = 0
+        while i > 0:
+            result += self.tree[i]
+            i -= i & -i
+        return result
+
+    def append(self, item, weight):
+        i = len(self.tree)
+        self.tree.append(self.prefix(i - 1) - self.prefix(i - (i & -i)) + weight)
+        self.items.append(item)
+        self.index[item] = i
+        self.total += weight
+
+    def weight(self, item):
+        i = self.index[item]
+        return self.prefix(i) - self.prefix(i - 1)
+
+    def update(self, item, delta):
+        # change the weight of an item, appending it when it has no slot yet
+        if item not in self.index:
+            self.append(item, delta)
+            return
+        i = self.index[item]
+        if self.weight(item) + delta == 0:
+            # the slot stays, but the item goes: if it comes back it is appended at the end,
+            # like a key re-inserted into a dict
+            del self.index[item]
+            self.items[i - 1] = None
+            self.empty += 1
+        self.total += delta
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+        if self.empty > len(self.items) // 2:
+            self.compact()
+
+    def compact(self):
+        weights = [(item, self.weight(item)) for item in self.items if item is not None]
+        self.__init__(weights)
+
+    def sample(self):
+        # the item at a uniform position in [0, total) of the cumulative weights
+        target = random.randrange(self.total)
+        i = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if i + step < len(self.tree) and self.tree[i + step] <= target:
+                i += step
+                target -= self.tree[i]
+            step >>= 1
+        return self.items[i]
+
+class Grammar:
+    # an immutable library of A rules, each an interned tuple of terminals with its count
+    # the total count, the longest rule length and the hash are computed once, and add/remove
+    # return a new Grammar built from a shallow copy of the counts
+    # `sampler` draws a rule by count and `eligible_sampler` a rule of two or more terminals
+    # by count; add/remove copy them (like the counts, since grammars are never changed in
+    # place) and then update the changed rule in O(log n), so a step costs O(number of rules),
+    # no longer O(total count) as the old count-expanded bag lists did
+    # printing a Grammar shows the same string-keyed dict the sampler used to print
+
+    __slots__ = ('counts', 'total', 'max_length', 'sampler', 'eligible_sampler', '_hash')
+
+    def __init__(self, counts):
+        self.counts = {intern_rule(rule): count for rule, count in counts.items()}
+        self.total = sum(self.counts.values())
+        self.max_length = max((len(rule) for rule in self.counts), default=0)
+        self.sampler = WeightedSampler(self.counts.items())
+        self.eligible_sampler = WeightedSampler((rule, count) for rule, count in self.counts.items() if len(rule) > 1)
+        self._hash = None
+
+    @classmethod
+    def from_dict(cls, rule_dict):
+        # from the {"A -> 'l' 'r'": count} form
+        return cls({parse_rule(rule): count for rule, count in rule_dict.items()})
+
+    @classmethod
+    def _make(cls, counts, total, max_length, rule, delta, sampler, eligible_sampler):
+        # a grammar whose samplers are copies of the given ones with the rule's weight changed by delta
+        grammar = cls.__new__(cls)
+        grammar.counts = counts
+        grammar.total = total
+        grammar.max_length = max_length
+        grammar.sampler = sampler.copy()
+        grammar.sampler.update(rule, delta)
+        grammar.eligible_sampler = eligible_sampler
+        if len(rule) > 1:
+            grammar.eligible_sampler = eligible_sampler.copy()
+            grammar.eligible_sampler.update(rule, delta)
+        grammar._hash = None
+        return grammar
+
+    def to_dict(self):
+        return {rule_string(rule): count for rule, count in self.counts.items()}
+
+    @property
+    def key(self):
+        # a canonical form that, unlike the hash, is the same in every process
+        return tuple(sorted(self.counts.items()))
+
+    def add(self, rule):
+        # one more copy of the rule
+        rule = intern_rule(rule)
+        counts = dict(self.counts)
+        counts[rule] = counts.get(rule, 0) + 1
+        return Grammar._make(counts, self.total + 1, max(self.max_length, len(rule)),
+                             rule, 1, self.sampler, self.eligible_sampler)
+
+    def remove(self, rule):
+        # one copy less of the rule, dropping it when none is left
+        counts = dict(self.counts)
+        max_length = self.max_length
+        if counts[rule] > 1:
+            counts[rule] -= 1
+        else:
+            del counts[rule]
+            if len(rule) == max_length:
+                max_length = max((len(r) for r in counts), default=0)
+        return Grammar._make(counts, self.total - 1, max_length, rule, -1, self.sampler, self.eligible_sampler)
+
+    def __getitem__(self, rule):
+        return self.counts[rule]
+
+    def __contains__(self, rule):
+        return rule in self.counts
+
+    def __iter__(self):
+        return iter(self.counts)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def keys(self):
+        return self.counts.keys()
+
+    def values(self):
+        return self.counts.values()
+
+    def items(self):
+        return self.counts.items()
+
+    def __eq__(self, other):
+        if isinstance(other, Grammar):
+            return self.counts == other.counts
+        return NotImplemented
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self.counts.items()))
+        return self._hash
+
+    def __reduce__(self):
+        # rebuilt from the counts, so the cached hash never crosses processes
+        return (Grammar, (self.counts,))
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    def __repr__(self):
+        return f"Grammar({self.to_dict()!r})"
+
+def as_grammar(grammar):
+    # accept the old string-keyed dicts wherever a Grammar is expected
+    return grammar if isinstance(grammar, Grammar) else Grammar.from_dict(grammar)
+
 def normalize_dict(rules):
-    total = sum(rules.values())
-    normalized_rules = {k: v / total for k, v in rules.items()}
+    rules = as_grammar(rules)
+    normalized_rules = {k: v / rules.total for k, v in rules.items()}
 
     a_rules = []
     for rule, prob in normalized_rules.items():
-        rhs = rule.split("->")[1].strip()
+        rhs = rule_string(rule).split("->")[1].strip()
         a_rules.append(f"{rhs} [{prob}]")
 
     a_rule_str = "A -> " + " | ".join(a_rules)
@@ -29,45 +247,39 @@ def normalize_dict(rules):
 
     return full_grammar
 
-def extract_terminals(rule_dict):
+def extract_terminals(grammar):
     mapping = {}
-    for rule, value in rule_dict.items():
-        rhs = rule.split("->")[1].strip()
-        symbols = rhs.split()
-        word = ''.join(s.strip("'") for s in symbols)
-        mapping[word] = value
+    for rule, value in grammar.items():
+        mapping[''.join(rule)] = value
     return mapping
 
-def parse_target_string(target_rule):
-    rhs = target_rule.split("->")[1].strip()
-    symbols = rhs.split()
-    return ''.join(s.strip("'") for s in symbols)
-
 def compute_probability(target, dictionary, p):
+    # probability of building target by concatenating two or more words of the dictionary,
+    # each drawn by weight, where every word after the second costs a factor p and stopping 1 - p
+    # mass[pos][k] is the total probability of the ways to write target[:pos] as k words,
+    # so no segmentation is ever listed
     total_weight = sum(dictionary.values())
-    vocab = set(dictionary.keys())
-
-    @lru_cache(None)
-    def dfs(pos):
-        if pos == len(target):
-            return [([], 1.0)]
-
-        results = []
-        for end in range(pos + 1, len(target) + 1):
+    max_word_length = max((len(word) for word in dictionary), default=0)
+    n = len(target)
+
+    mass = [[0.0] * (n + 1) for _ in range(n + 1)]
+    mass[0][0] = 1.0
+    for pos in range(n):
+        pieces = [(k, m) for k, m in enumerate(mass[pos]) if m]
+        if not pieces:
+            continue
+        for end in range(pos + 1, min(n, pos + max_word_length) + 1):
             word = target[pos:end]
-            if word in vocab:
+            if word in dictionary:
                 weight_prob = dictionary[word] / total_weight
-                rest_paths = dfs(end)
-                for rest_seq, rest_prob in rest_paths:
-                    results.append(([word] + rest_seq, weight_prob * rest_prob))
-        return results
+                for k, m in pieces:
+                    mass[end][k + 1] += m * weight_prob
 
-    all_paths = dfs(0)
     final_prob = 0.0
-    for path, prob in all_paths:
-        if len(path) >= 2:
-            control_prob = (p ** (len(path) - 2)) * (1 - p)
-            final_prob += prob * control_prob
+    for k in range(2, n + 1):
+        if mass[n][k]:
+            control_prob = (p ** (k - 2)) * (1 - p)
+            final_prob += mass[n][k] * control_prob
 
     return final_prob
 
@@ -75,22 +287,98 @@ def prior(grammar, param_one=4, param_two=4):
     # prior distribution: we choose exponential
     # log probability
     # for simplicity we don't normalize the prior probabilities
+    # the penalty grows with the number of rules and the length of the longest rule
+    grammar = as_grammar(grammar)
+    return - (param_one * len(grammar)) - (param_two * grammar.max_length)
+
+def log_sum_exp(values):
+    # log(sum(exp(v) for v in values)) without leaving log space
+    values = [v for v in values if v != -math.inf]
+    if not values:
+        return -math.inf
+    largest = max(values)
+    return largest + math.log(sum(math.exp(v - largest) for v in values))
+
+def rule_log_probabilities(grammar):
+    # log probability of every A rule, keyed by its tuple of terminals
+    return {rule: math.log(count / grammar.total) for rule, count in grammar.items()}
+
+def inside_log_probability(sentence, log_probs):
+    # log probability of a sentence under S -> S S [0.5] | A [0.5] and the A rules in log_probs,
+    # summed over every parse tree with the inside algorithm in O(n^3) instead of one term per tree
+    # inside[i][j] is the log probability that S derives sentence[i:j]
+    n = len(sentence)
+    log_half = math.log(0.5)
+    max_rule_length = max(len(rhs) for rhs in log_probs)
+    inside = [[-math.inf] * (n + 1) for _ in range(n + 1)]
+
+    for length in range(1, n + 1):
+        for i in range(n - length + 1):
+            j = i + length
+            terms = []
+            if length <= max_rule_length:
+                rhs = tuple(sentence[i:j])
+                if rhs in log_probs:
+                    terms.append(log_half + log_probs[rhs])
+            for k in range(i + 1, j):
+                terms.append(log_half + inside[i][k] + inside[k][j])
+            inside[i][j] = log_sum_exp(terms)
+
+    return inside[0][n]
+
+def count_sentences(sentences):
+    # group a corpus into its unique sentences (as tuples) and their multiplicities
+    return Counter(tuple(sentence) for sentence in sentences)
+
+def read_corpus(path):
+    # stream sentences from a file with one sequence per line
+    # tokens are separated by whitespace; a line without any is read one character per token,
+    # which is how generate.py prints its sentences
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield line.split() if any(c.isspace() for c in line) else list(line)
+
+def load_corpus(path):
+    # a counted corpus read from a text file or a corpus directory (see corpus.py), without
+    # ever holding the duplicate sentences
+    if is_corpus(path):
+        return Corpus(path).counts()
+    return count_sentences(read_corpus(path))
+
+def counted_corpus(sentences):
+    # the unique sentences and their counts, from a list of sentences, a memory-mapped Corpus
+    # or an already counted corpus
+    if isinstance(sentences, dict):
+        return sentences
+    if isinstance(sentences, Corpus):
+        return sentences.counts()
+    return count_sentences(sentences)
 
-    # the length of the longest rule in the grammar
-    max_length = 0
+def likelihood(grammar, sentences):
+    # likelihood: probability of sequence given the library
+    # sentences is a list of sentences, a memory-mapped Corpus or an already counted corpus
+    # (count_sentences / load_corpus); each unique sentence is scored once and weighted by its count
+    # a sentence the grammar cannot produce gives -inf
+    log_probs = rule_log_probabilities(as_grammar(grammar))
+    corpus = counted_corpus(sentences)
 
-    for rule in grammar.keys():
-        count = len(rule.split("->")[1].strip().split())
-        max_length = max(max_length, count)
+    log_probability = 0
+    for sentence, count in corpus.items():
+        log_probability += count * inside_log_probability(sentence, log_probs)
 
-    return - (param_one * len(grammar)) - (param_two * max_length)
+    return log_probability
 
-def likelihood(grammar, sentences):
-    # likelihood: probability of sequence given the library
-    parser = ChartParser(PCFG.fromstring(normalize_dict(grammar)))
+def chart_likelihood(grammar, sentences):
+    # the same likelihood, summed tree by tree over an NLTK chart parse
+    # exponential in sentence length; kept as a reference for likelihood
+    pcfg = PCFG.fromstring(normalize_dict(grammar))
+    parser = ChartParser(pcfg)
     
     probs_dict = {}
-    for probs in PCFG.fromstring(normalize_dict(grammar)).productions():
+    for probs in pcfg.productions():
         clean_probs = clean_text(str(probs))
         probs_dict[clean_probs[0]] = clean_probs[1]
 
@@ -108,100 +396,439 @@ def likelihood(grammar, sentences):
 
     return log_probability
 
+def make_scorer(sentences, maxsize=4096):
+    # returns score(grammar) -> (prior, likelihood) for a fixed corpus
+    # scores are kept in an LRU cache keyed by the grammar, since proposals often come back
+    # to grammars the chain has already visited
+    corpus = counted_corpus(sentences)
+
+    @lru_cache(maxsize)
+    def score(grammar):
+        return prior(grammar), likelihood(grammar, corpus)
+
+    return score
+
+def substring_columns(corpus):
+    # every distinct substring of the corpus gets a column, since only a rule equal to one of
+    # them can ever be used in a parse; for each unique sentence, ids[length][i] is the column
+    # of sentence[i:i + length] (ids[0] is unused)
+    columns = {}
+    tables = []
+    for sentence, count in corpus.items():
+        n = len(sentence)
+        ids = [None]
+        for length in range(1, n + 1):
+            ids.append(np.array([columns.setdefault(tuple(sentence[i:i + length]), len(columns))
+                                 for i in range(n - length + 1)], dtype=np.intp))
+        tables.append((ids, count))
+    return columns, tables
+
+def log_sum_exp_array(stack):
+    # log_sum_exp along the first axis of an array, with -inf wherever every term is -inf
+    largest = stack.max(axis=0)
+    shift = np.where(np.isfinite(largest), largest, 0.0)
+    with np.errstate(divide='ignore'):
+        return shift + np.log(np.exp(stack - shift).sum(axis=0))
+
+def make_batch_scorer(sentences):
+    # returns score(grammars) -> array of the likelihood of each grammar, for a fixed corpus
+    # the substrings of the corpus are matched once up front; a batch of grammars is then a
+    # (substrings x grammars) table of rule log probabilities, and the inside pass of each
+    # sentence runs over all the grammars at once, one array operation per span length and split
+    # gives the same values as likelihood (up to float rounding)
+    corpus = counted_corpus(sentences)
+    columns, tables = substring_columns(corpus)
+    log_half = math.log(0.5)
+
+    def score(grammars):
+        grammars = [as_grammar(grammar) for grammar in grammars]
+        log_probs = np.full((len(columns), len(grammars)), -np.inf)
+        for g, grammar in enumerate(grammars):
+            for rule, count in grammar.items():
+                column = columns.get(rule)
+                if column is not None:
+                    log_probs[column, g] = math.log(count / grammar.total)
+
+        result = np.zeros(len(grammars))
+        for ids, count in tables:
+            n = len(ids) - 1
+            # chart[length][i] is the inside log probability of sentence[i:i + length], per grammar
+            chart = [None]
+            for length in range(1, n + 1):
+                starts = n - length + 1
+                terms = [log_half + log_probs[ids[length]]]
+                for left in range(1, length):
+                    terms.append(log_half + chart[left][:starts] + chart[length - left][left:left + starts])
+                chart.append(log_sum_exp_array(np.stack(terms)))
+            result += count * chart[n][0]
+        return result
+
+    return score
+
+def batch_likelihood(grammars, sentences):
+    # likelihood of every grammar in a list, as an array
+    return make_batch_scorer(sentences)(grammars)
+
+def single_rule_additions(grammar, sentences):
+    # every grammar one added rule away that can change the likelihood: one more copy of each
+    # substring of the corpus with two or more terminals
+    # score them with make_batch_scorer to find the best next rule
+    grammar = as_grammar(grammar)
+    corpus = counted_corpus(sentences)
+    rules = {}
+    for sentence in corpus:
+        for i in range(len(sentence)):
+            for j in range(i + 2, len(sentence) + 1):
+                rules.setdefault(tuple(sentence[i:j]))
+    return [grammar.add(rule) for rule in rules]
+
 def proposal(grammar, num_primitives, resample_parameter=0.4):
     # propose distribution: to modify the grammar
     # returns the sampled new grammar, and the forward/reverse probability
     # for simplicity, in our proposal we don't consider counts; we leave the different probabilities to the likelihood computation
     # here we ensure that there will be things to delete when we choose to delete
     # count of primitives (or basic primitives) are always 1
-    choice = random.choices(["add", "delete"], weights = [num_primitives, sum(grammar.values()) - num_primitives])
-
-    # dictionaries are mutable in Python, so we need to copy them to prevent leaking
-    current_grammar = copy.deepcopy(grammar)
+    grammar = as_grammar(grammar)
+    choice = random.choices(["add", "delete"], weights = [num_primitives, grammar.total - num_primitives])
 
     if choice == ["add"]:
         # in order to prevent the irreversibility problem, we choose to concatenate multiple rules together (can be two or more)
-        bag = []
-        for rule in grammar.keys():
-            bag += [rule] * current_grammar[rule]
-
-        samples = [random.choice(bag), random.choice(list(bag))]
+        # rules are drawn by count from the grammar's sampler
+        samples = [grammar.sampler.sample(), grammar.sampler.sample()]
         
         while random.random() < resample_parameter:
-            samples.append(random.choice(bag))
+            samples.append(grammar.sampler.sample())
 
-        result = "A -> " + " ".join(rule.split(" -> ")[1] for rule in samples)
+        result = tuple(symbol for rule in samples for symbol in rule)
 
         # the overall probability of getting an output added rule given an input grammar
-        prob = compute_probability(parse_target_string(result), extract_terminals(current_grammar), resample_parameter)
-        proposal_probability = math.log(num_primitives / sum(current_grammar.values())) + math.log(prob)
+        prob = compute_probability(''.join(result), extract_terminals(grammar), resample_parameter)
+        proposal_probability = math.log(num_primitives / grammar.total) + math.log(prob)
 
-        if result in current_grammar:
-            current_grammar[result] += 1
-        else:
-            current_grammar[result] = 1
+        current_grammar = grammar.add(result)
 
         # probability of delete over add, multiplied by that of choosing one rule to delete
-        reverse_probability = math.log(current_grammar[result] / sum(current_grammar.values()))
+        reverse_probability = math.log(current_grammar[result] / current_grammar.total)
 
     elif choice == ["delete"]:
-        # find all options with length > 1 (not primitives)
+        # only options with length > 1 (not primitives) can be removed
         # we're guaranteed that there must be at least one if we choose to delete
-        eligible_options = [rule for rule in current_grammar.keys() if len(rule.split("->")[1].strip().split()) > 1]
-
         # We choose the option to remove based on their counts
-        bag = []
-        for rule in eligible_options:
-            bag += [rule] * current_grammar[rule]
-
-        option_to_remove = random.choice(bag)
+        option_to_remove = grammar.eligible_sampler.sample()
 
-        if current_grammar[option_to_remove] > 1:
-            new_grammar = {k: (v - 1 if k == option_to_remove else v) for k, v in current_grammar.items()}
-        elif current_grammar[option_to_remove] == 1:
-            new_grammar = {k: v for k, v in current_grammar.items() if k != option_to_remove}
+        proposal_probability = math.log(grammar[option_to_remove] / grammar.total)
+        current_grammar = grammar.remove(option_to_remove)
 
-        proposal_probability = math.log(current_grammar[option_to_remove] / sum(current_grammar.values()))
-        current_grammar = new_grammar
-
-        prob = compute_probability(parse_target_string(option_to_remove), extract_terminals(current_grammar), resample_parameter)
-        reverse_probability = math.log(num_primitives / sum(current_grammar.values())) + math.log(prob)
+        prob = compute_probability(''.join(option_to_remove), extract_terminals(current_grammar), resample_parameter)
+        reverse_probability = math.log(num_primitives / current_grammar.total) + math.log(prob)
     
     return current_grammar, proposal_probability, reverse_probability
 
-def main():
+def write_sample(f, step, grammar, prior_p, likelihood_p):
+    # one line of the sample stream: the grammar the chain moved to after `step` steps
+    record = {"step": step, "grammar": grammar.to_dict(), "prior": prior_p, "likelihood": likelihood_p}
+    f.write(json.dumps(record) + "\n")
+
+def read_samples(path):
+    # lazily yield (step, grammar, prior, likelihood) from a sample stream, one accepted
+    # state at a time; the first record is the initial grammar at step 0
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            yield record["step"], Grammar.from_dict(record["grammar"]), record["prior"], record["likelihood"]
+
+def read_trace(path, t, burn_in=0, thin=1):
+    # lazily rebuild the (grammar size, log posterior) trace of a chain from its sample stream,
+    # with the same burn_in and thin as run_chain
+    records = read_samples(path)
+    _, grammar, prior_p, likelihood_p = next(records)
+    upcoming = next(records, None)
+    for step in range(t):
+        # the state after the step is the last one accepted at or before it
+        while upcoming is not None and upcoming[0] <= step + 1:
+            _, grammar, prior_p, likelihood_p = upcoming
+            upcoming = next(records, None)
+        if step < burn_in or (step - burn_in) % thin:
+            continue
+        yield len(grammar), prior_p + likelihood_p
+
+def save_checkpoint(path, state):
+    # written to a temporary file first, so an interruption never leaves a broken checkpoint
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+def load_checkpoint(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+def metropolis_step(grammar, prior_p, likelihood_p, score, num_primitives, beta=1):
+    # one Metropolis-Hastings step targeting the posterior raised to the power beta (an inverse
+    # temperature; beta = 1 is the posterior itself)
+    # returns the grammar after the step, its scores and whether the proposal was accepted
+    new_grammar, proposal_probability, reverse_probability = proposal(grammar, num_primitives)
+    new_prior_p, new_likelihood_p = score(new_grammar)
+
+    log_acceptance_p = min(0, beta * new_prior_p + beta * new_likelihood_p + reverse_probability - beta * prior_p - beta * likelihood_p - proposal_probability)
+    acceptance_p = math.exp(log_acceptance_p)
+
+    a = random.uniform(0, 1)
+    if a < acceptance_p:
+        return new_grammar, new_prior_p, new_likelihood_p, True
+    return grammar, prior_p, likelihood_p, False
+
+def run_chain(initial_grammar, sentences, num_primitives, t, seed=None, burn_in=0, thin=1, verbose=False,
+              sample_path=None, checkpoint_path=None, checkpoint_every=1000, resume=False):
+    # one Metropolis-Hastings chain of t steps
+    # returns the histogram of sampled grammars (keyed by Grammar) and the trace of
+    # (grammar size, log posterior) for the same samples; the first burn_in steps are
+    # dropped and only every thin-th step after them is kept
+    # the current grammar's scores are carried over from the step that accepted it,
+    # so each step scores at most the proposed grammar, and not even that on a cache hit
+    #
+    # with a sample_path, every accepted state is appended to that JSONL file as it happens
+    # (see read_samples) and the trace is not kept in memory, so the memory of a long run only
+    # grows with the number of distinct grammars; read_trace rebuilds the trace from the file
+    # with a checkpoint_path, the chain state, the random state and the histogram are saved
+    # every checkpoint_every steps and at the end; resume=True continues from that checkpoint
+    # (if it exists) exactly where the uninterrupted run would have been, and cuts the sample
+    # stream back to what had been written when it was saved
+    score = make_scorer(sentences)
+    start = 0
+    sample_offset = 0
+    if resume and checkpoint_path is not None and os.path.exists(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+        random.setstate(state["random_state"])
+        start = state["step"]
+        grammar = state["grammar"]
+        prior_p, likelihood_p = state["prior"], state["likelihood"]
+        sample_results = state["sample_results"]
+        trace = state["trace"]
+        sample_offset = state["sample_offset"]
+    else:
+        if seed is not None:
+            random.seed(seed)
+        grammar = as_grammar(initial_grammar)
+        prior_p, likelihood_p = score(grammar)
+        sample_results = {}
+        trace = []
+
+    sample_file = None
+    if sample_path is not None:
+        sample_file = open(sample_path, "a+" if start else "w")
+        sample_file.seek(sample_offset)
+        sample_file.truncate()
+        if not start:
+            write_sample(sample_file, 0, grammar, prior_p, likelihood_p)
+
+    def checkpoint(step):
+        if sample_file is not None:
+            sample_file.flush()
+        save_checkpoint(checkpoint_path, {
+            "step": step,
+            "grammar": grammar,
+            "prior": prior_p,
+            "likelihood": likelihood_p,
+            "random_state": random.getstate(),
+            "sample_results": sample_results,
+            "trace": trace,
+            "sample_offset": sample_file.tell() if sample_file is not None else 0,
+        })
+
+    for step in tqdm(range(start, t), initial=start, total=t, disable=not verbose):
+        if checkpoint_path is not None and step > start and step % checkpoint_every == 0:
+            checkpoint(step)
+        if verbose:
+            print(grammar)
+        grammar, prior_p, likelihood_p, accepted = metropolis_step(grammar, prior_p, likelihood_p, score, num_primitives)
+        if accepted:
+            if sample_file is not None:
+                write_sample(sample_file, step + 1, grammar, prior_p, likelihood_p)
+
+        if step < burn_in or (step - burn_in) % thin:
+            continue
+        if grammar not in sample_results:
+            sample_results[grammar] = 1
+        else:
+            sample_results[grammar] += 1
+        if sample_file is None:
+            trace.append((len(grammar), prior_p + likelihood_p))
+
+    if checkpoint_path is not None:
+        checkpoint(t)
+    if sample_file is not None:
+        sample_file.close()
+
+    return sample_results, trace
+
+def autocovariance(values, lag):
+    n = len(values)
+    mean = sum(values) / n
+    return sum((values[i] - mean) * (values[i + lag] - mean) for i in range(n - lag)) / n
+
+def split_chains(chains):
+    # each chain cut into its two halves, so a chain that drifts also shows up as
+    # disagreement between chains, and a single chain can be diagnosed
+    n = len(chains[0]) // 2
+    return [half for chain in chains for half in (chain[:n], chain[n:2 * n])]
+
+def chain_variances(chains):
+    # within-chain variance W and the pooled posterior variance estimate
+    # both are nan when the chains have fewer than 2 values each
+    m, n = len(chains), len(chains[0])
+    if n < 2:
+        return float('nan'), float('nan')
+    means = [sum(chain) / n for chain in chains]
+    grand_mean = sum(means) / m
+    between = n * sum((mean - grand_mean) ** 2 for mean in means) / (m - 1)
+    within = sum(sum((x - mean) ** 2 for x in chain) / (n - 1) for chain, mean in zip(chains, means)) / m
+    pooled = (n - 1) / n * within + between / n
+    return within, pooled
+
+def rhat(chains):
+    # split Gelman-Rubin potential scale reduction over equally long chains
+    # (values near 1 mean converged)
+    # nan when the chains are too short to split (fewer than 4 values) or never move
+    within, pooled = chain_variances(split_chains(chains))
+    if math.isnan(within) or within == 0:
+        return float('nan')
+    return math.sqrt(pooled / within)
+
+def effective_sample_size(chains):
+    # multi-chain effective sample size, summing autocorrelations in pairs until
+    # a pair turns negative (Geyer's initial positive sequence)
+    chains = split_chains(chains)
+    m, n = len(chains), len(chains[0])
+    within, pooled = chain_variances(chains)
+    if math.isnan(pooled) or pooled == 0:
+        return float('nan')
+
+    def rho(lag):
+        mean_autocovariance = sum(autocovariance(chain, lag) for chain in chains) / m
+        return 1 - (within - mean_autocovariance) / pooled
+
+    total = 0
+    lag = 1
+    while lag + 1 < n:
+        pair = rho(lag) + rho(lag + 1)
+        if pair < 0:
+            break
+        total += pair
+        lag += 2
+    return m * n / (1 + 2 * total)
+
+def run_chain_from_args(args):
+    return run_chain(*args)
+
+def run_chains(initial_grammar, sentences, num_primitives, t, chains=4, seeds=None, burn_in=0, thin=1, workers=None):
+    # independent chains with their own seeds on a process pool
+    # returns the merged histogram of sampled grammars and, for grammar size and log posterior,
+    # R-hat and effective sample size across the chains
+    if seeds is None:
+        seeds = list(range(chains))
+    corpus = counted_corpus(sentences)
+    jobs = [(initial_grammar, corpus, num_primitives, t, seed, burn_in, thin) for seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_chain_from_args, jobs))
+
+    sample_results = Counter()
+    for chain_results, _ in results:
+        sample_results.update(chain_results)
+
+    diagnostics = {}
+    for i, statistic in enumerate(["grammar_size", "log_posterior"]):
+        values = [[sample[i] for sample in trace] for _, trace in results]
+        diagnostics[statistic] = {"rhat": rhat(values), "ess": effective_sample_size(values)}
+
+    return dict(sample_results), diagnostics
+
+def temperature_ladder(replicas=4, max_temperature=1.5):
+    # geometrically spaced temperatures from 1 (the posterior) up to max_temperature
+    # posterior differences between grammars are tens of nats, so already a modest top
+    # temperature mixes well; much hotter ladders rarely get a swap accepted
+    if replicas == 1:
+        return [1.0]
+    return [max_temperature ** (k / (replicas - 1)) for k in range(replicas)]
+
+def run_tempered(initial_grammar, sentences, num_primitives, t, temperatures=None, seed=None, burn_in=0, thin=1, verbose=False):
+    # parallel tempering: one replica per temperature, each a Metropolis-Hastings chain on the
+    # posterior raised to 1 / temperature, so the hot replicas cross between grammar sizes
+    # that the prior penalties keep apart in a single chain
+    # after every step, neighbouring replicas try to swap their grammars, alternating between
+    # the even and the odd pairs of the ladder
+    # the replicas share one score cache, and only the cold (temperature 1) replica is sampled:
+    # returns its histogram and trace, like run_chain, and statistics with the swap acceptance
+    # rate of every neighbouring pair and the number of likelihood evaluations
+    if seed is not None:
+        random.seed(seed)
+    if temperatures is None:
+        temperatures = temperature_ladder()
+    betas = [1 / temperature for temperature in temperatures]
+    score = make_scorer(sentences)
+    grammar = as_grammar(initial_grammar)
+    prior_p, likelihood_p = score(grammar)
+    states = [(grammar, prior_p, likelihood_p) for _ in betas]
+    swap_attempts = [0] * (len(betas) - 1)
+    swap_accepts = [0] * (len(betas) - 1)
+    sample_results = {}
+    trace = []
+    for step in tqdm(range(t), disable=not verbose):
+        for k, beta in enumerate(betas):
+            states[k] = metropolis_step(*states[k], score, num_primitives, beta)[:3]
+
+        for k in range(step % 2, len(betas) - 1, 2):
+            posterior = states[k][1] + states[k][2]
+            hotter_posterior = states[k + 1][1] + states[k + 1][2]
+            log_acceptance_p = min(0, (betas[k] - betas[k + 1]) * (hotter_posterior - posterior))
+            swap_attempts[k] += 1
+            if random.uniform(0, 1) < math.exp(log_acceptance_p):
+                states[k], states[k + 1] = states[k + 1], states[k]
+                swap_accepts[k] += 1
+
+        if step < burn_in or (step - burn_in) % thin:
+            continue
+        grammar, prior_p, likelihood_p = states[0]
+        if grammar not in sample_results:
+            sample_results[grammar] = 1
+        else:
+            sample_results[grammar] += 1
+        trace.append((len(grammar), prior_p + likelihood_p))
+
+    stats = {
+        "temperatures": list(temperatures),
+        "swap_rates": [accepts / attempts if attempts else float('nan') for accepts, attempts in zip(swap_accepts, swap_attempts)],
+        "likelihood_evaluations": score.cache_info().misses,
+    }
+    return sample_results, trace, stats
+
+def main(sample_path=None, checkpoint_path=None, resume=False, tempered=False, corpus_path=None):
     # the main function that carries out Metropolis-Hastings
+    # pass a sample_path to stream the accepted grammars to a file and a checkpoint_path
+    # (with resume=True on a rerun) to survive interruptions, e.g.
+    # python mcmc.py samples.jsonl chain.ckpt --resume
+    # or run the parallel-tempering sampler instead with python mcmc.py --tempered
+    # a corpus directory written by generate.py replaces the built-in sentences with
+    # --corpus=PATH, and its tokens become the primitives
     # step 1: initialize the grammar (the library) and the sequence
-    initial_grammar = {"A -> 'l'": 1, "A -> 'f'": 1, "A -> 'm'": 1, "A -> 'r'": 1}
-    sentences = [['l','r','m','l','r'], ['l','r','l','r'], ['l','r','m','l','r'], ['l','r','r','r'], ['l','f'], ['l','f','m','l'], ['l','f','m','l'], ['l','f','m','l'], ['l','r','r','r'], ['l','f'], ['l','r','m','l','r','m','l'], ['l','r','m','l','r','m','l'], ['l','r','r','m','l','r','m','l'], ['l','r','m','l','f','m','l']]
-    num_primitives = 4
+    if corpus_path is None:
+        initial_grammar = Grammar.from_dict({"A -> 'l'": 1, "A -> 'f'": 1, "A -> 'm'": 1, "A -> 'r'": 1})
+        sentences = [['l','r','m','l','r'], ['l','r','l','r'], ['l','r','m','l','r'], ['l','r','r','r'], ['l','f'], ['l','f','m','l'], ['l','f','m','l'], ['l','f','m','l'], ['l','r','r','r'], ['l','f'], ['l','r','m','l','r','m','l'], ['l','r','m','l','r','m','l'], ['l','r','r','m','l','r','m','l'], ['l','r','m','l','f','m','l']]
+        num_primitives = 4
+    else:
+        sentences = Corpus(corpus_path)
+        initial_grammar = Grammar({(token,): 1 for token in sentences.vocabulary})
+        num_primitives = len(sentences.vocabulary)
 
     # step 2: loop
     # sample a new grammar and evaluate probabilities
     # accept or reject
     t = 1000
-    grammar = initial_grammar
-    sample_results = {}
-    for _ in tqdm(range(t)):
-        prior_p = prior(grammar)
-        likelihood_p = likelihood(grammar, sentences)
-
-        print(grammar)
-        new_grammar, proposal_probability, reverse_probability = proposal(grammar, num_primitives)
-        new_prior_p = prior(new_grammar)
-        new_likelihood_p = likelihood(new_grammar, sentences)
-
-        log_acceptance_p = min(0, new_prior_p + new_likelihood_p + reverse_probability - prior_p - likelihood_p - proposal_probability)
-        acceptance_p = math.exp(log_acceptance_p)
-
-        a = random.uniform(0, 1)
-        if a < acceptance_p:
-            grammar = new_grammar
-
-        if str(grammar) not in sample_results:
-            sample_results[str(grammar)] = 1
-        else:
-            sample_results[str(grammar)] += 1
+    if tempered:
+        sample_results, _, stats = run_tempered(initial_grammar, sentences, num_primitives, t, verbose=True)
+        print(stats)
+    else:
+        sample_results, _ = run_chain(initial_grammar, sentences, num_primitives, t, verbose=True,
+                                      sample_path=sample_path, checkpoint_path=checkpoint_path, resume=resume)
 
     result_dict = dict(sorted(sample_results.items(), key=lambda item: item[1], reverse=True))
 
@@ -210,4 +837,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    corpus_path = next((arg[len("--corpus="):] for arg in sys.argv[1:] if arg.startswith("--corpus=")), None)
+    main(*args, resume="--resume" in sys.argv[1:], tempered="--tempered" in sys.argv[1:], corpus_path=corpus_path)
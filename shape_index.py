@@ -0,0 +1,158 @@
+import functools
+import mmap
+import os
+import struct
+
+from bitboard import ACTION_NAMES, BOARD_SIZE, get_geometry
+
+# an on-disk index from every shape reachable within `depth` actions to its shortest programs
+#
+# layout (little-endian):
+#   header   magic, version, board size, bitboard radius, depth, number of entries,
+#            key width in bytes, and the action alphabet the programs are written in
+#   entries  one fixed-size record per shape, sorted by key: the shape's bitboard mask as a
+#            big-endian key (so byte order is numeric order), the shortest program length,
+#            and the offset and number of its programs in the blob
+#   blob     the programs, one byte per action (its position in the alphabet)
+#
+# the file is memory-mapped and searched in place, so opening it costs nothing and a lookup
+# is a binary search over the entries
+
+MAGIC = b'HEXIDX\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIIII16s')
+RECORD = struct.Struct('<BII')
+
+DEFAULT_DEPTH = 7
+# next to this file, so the solver finds it from any working directory
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shape_index.bin')
+
+def shortest_programs(depth):
+    # breadth-first search from the empty board keeping, for every shape, the depth it is
+    # first reached at and every edge that reaches it at that depth
+    # the empty board itself is only counted once an action leads back to it, since the
+    # solver never returns the empty program
+    geometry = get_geometry(depth + 1)
+    actions = [geometry.actions[cmd] for cmd in ACTION_NAMES]
+    first_depth = {}
+    pointers = {}
+    frontier = [0]
+    for length in range(1, depth + 1):
+        new_frontier = []
+        for state in frontier:
+            for i, action in enumerate(actions):
+                new_state = action(state)
+                if new_state not in first_depth:
+                    first_depth[new_state] = length
+                    pointers[new_state] = [(state, i)]
+                    new_frontier.append(new_state)
+                elif first_depth[new_state] == length:
+                    pointers[new_state].append((state, i))
+        frontier = new_frontier
+
+    @functools.lru_cache(None)
+    def programs(state, length):
+        if length == 0:
+            return [()]
+        result = []
+        for prev_state, i in pointers[state]:
+            for prefix in programs(prev_state, length - 1):
+                result.append(prefix + (i,))
+        return result
+
+    for state, length in first_depth.items():
+        # sorted action indices are the solver's itertools.product order
+        yield state, length, sorted(programs(state, length))
+
+def build_index(path=DEFAULT_INDEX_PATH, depth=DEFAULT_DEPTH):
+    geometry = get_geometry(depth + 1)
+    key_bytes = (geometry.inside.bit_length() + 7) // 8
+    entries = sorted(shortest_programs(depth))
+
+    records = []
+    blob = bytearray()
+    for state, length, programs in entries:
+        records.append(state.to_bytes(key_bytes, 'big') + RECORD.pack(length, len(blob), len(programs)))
+        for program in programs:
+            blob.extend(program)
+
+    alphabet = ''.join(ACTION_NAMES).encode()
+    # written next to the old index and then swapped in, so an index that is still mapped
+    # keeps reading the old file instead of one being truncated under it
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, BOARD_SIZE, geometry.radius, depth, len(records), key_bytes, alphabet))
+        for record in records:
+            f.write(record)
+        f.write(blob)
+    os.replace(path + '.tmp', path)
+    # later open_index calls map the new file
+    open_index.cache_clear()
+    return len(records)
+
+class ShapeIndex:
+    # read-only view of an index file; get one through open_index
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, board_size, radius, depth, size, key_bytes, alphabet = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} shape index")
+        if board_size != BOARD_SIZE:
+            raise ValueError(f"{path} was built for a board of size {board_size}")
+        self.depth = depth
+        self.size = size
+        self.key_bytes = key_bytes
+        self.alphabet = alphabet.rstrip(b'\x00').decode()
+        self.geometry = get_geometry(radius)
+        self.record_size = key_bytes + RECORD.size
+        self.blob_start = HEADER.size + size * self.record_size
+
+    def find(self, key):
+        # binary search for the record with this key, None when absent
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            start = HEADER.size + middle * self.record_size
+            current = self.data[start:start + self.key_bytes]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return start + self.key_bytes
+        return None
+
+    def lookup(self, goal_shape):
+        # (shortest length, shortest programs) of the goal, or None when it is not reachable
+        # within the index depth
+        try:
+            mask = self.geometry.from_cells(goal_shape)
+        except ValueError:
+            return None
+        position = self.find(mask.to_bytes(self.key_bytes, 'big'))
+        if position is None:
+            return None
+        length, offset, count = RECORD.unpack_from(self.data, position)
+        start = self.blob_start + offset
+        programs = []
+        for i in range(count):
+            program = self.data[start + i * length:start + (i + 1) * length]
+            programs.append([self.alphabet[a] for a in program])
+        return length, programs
+
+    def close(self):
+        self.data.close()
+
+@functools.lru_cache(None)
+def open_index(path=DEFAULT_INDEX_PATH):
+    # one mapping per path; build_index clears this when it replaces a file
+    return ShapeIndex(path)
+
+def main():
+    print(f"Building shape index up to depth {DEFAULT_DEPTH}...")
+    size = build_index(DEFAULT_INDEX_PATH, DEFAULT_DEPTH)
+    print(f"Wrote {size} shapes to {DEFAULT_INDEX_PATH}")
+
+if __name__ == "__main__":
+    main()
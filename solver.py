@@ -1,179 +1,599 @@
-import itertools
-
-BOARD_SIZE = 9
-
-def check_goal(shapes, goal_shape):
-    return set(shapes[0]) == set(goal_shape)
-
-def get_shape_from_sequence(sequence):
-    shapes = [[]]
-    for cmd in sequence:
-        func = ACTIONS[cmd]
-        shapes = func(shapes)
-    return shapes[0]
-
-def create_center(shapes):
-    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
-    shapes[0].append((cx, cy))
-
-    return shapes
-
-def add_bar(shapes):
-    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
-    bar = [(cx - 1, cy - 1), (cx, cy), (cx + 1, cy)]
-    shapes[0].extend(bar)
-    return shapes
-
-def add_corner(shapes):
-    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
-    corner = [(cx + 1, cy - 1), (cx, cy), (cx, cy + 1)]
-    shapes[0].extend(corner)
-    return shapes
-
-def delete_center(shapes):
-    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
-    for shape in shapes:
-        while (cx, cy) in shape:
-            shape.remove((cx, cy))
-    return shapes
-
-def move_west(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            shape[i] = (x, y - 1)
-    return shapes
-
-def move_northeast(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            q, r = offset_to_axial(x, y)
-            q += 1
-            r -= 1
-            shape[i] = axial_to_offset(q, r)
-    return shapes
-
-def move_southeast(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            q, r = offset_to_axial(x, y)
-            r += 1
-            shape[i] = axial_to_offset(q, r)
-    return shapes
-
-def offset_to_axial(x, y):
-    if x <= BOARD_SIZE // 2:
-        q = y - x
-    else:
-        q = y - BOARD_SIZE // 2
-    r = x - BOARD_SIZE // 2
-    return q, r
-
-def axial_to_offset(q, r):
-    x = r + BOARD_SIZE // 2
-    if x <= BOARD_SIZE // 2:
-        y = q + r + BOARD_SIZE // 2
-    else:
-        y = q + BOARD_SIZE // 2
-    return x, y
-
-def axial_to_cube(q, r):
-    x = q
-    z = r
-    y = -x - z
-    return (x, y, z)
-
-def cube_to_axial(x, y, z):
-    q = x
-    r = z
-    return (q, r)
-
-def rotate60(a, b):
-    q, r = offset_to_axial(a, b)
-    x, y, z = axial_to_cube(q, r)
-    x, y, z = -z, -x, -y
-
-    return axial_to_offset(*cube_to_axial(x, y, z))
-
-def flip_nw_to_se(a, b):
-    q, r = offset_to_axial(a, b)
-    return axial_to_offset(-q, q + r)
-
-def flip_ne_to_sw(a, b):
-    q, r = offset_to_axial(a, b)
-    return axial_to_offset(q, -q - r)
-
-def rotate(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            shape[i] = rotate60(x, y)
-    return shapes
-
-def flip(shapes):
-    for shape in shapes:
-        for i in range(len(shape)):
-            x, y = shape[i]
-            shape[i] = flip_ne_to_sw(x, y)
-    return shapes
-
-def reflect(shapes):
-    reflected_shapes = []
-    for shape in shapes:
-        original = shape[:]
-        flipped = [flip_ne_to_sw(x, y) for (x, y) in shape]
-        combined = list(set(original + flipped))
-        reflected_shapes.append(combined)
-    return reflected_shapes
-
-ACTIONS = {
-    'a': create_center,
-    'd': delete_center,
-    'z': add_corner,
-    'x': add_bar,
-    'w': move_west,
-    'e': move_northeast,
-    's': move_southeast,  
-    'f': flip,
-    'r': reflect,
-    ' ': rotate,
-}
-
-def goal_solver(goal_shape, max_depth=7):
-    action_keys = list(ACTIONS.keys())
-    solutions = []
-
-    for length in range(1, max_depth + 1):
-        for cmd_seq in itertools.product(action_keys, repeat=length):
-            shapes = [[]]
-            for cmd in cmd_seq:
-                func = ACTIONS[cmd]
-                shapes = func(shapes)
-            if check_goal(shapes, goal_shape):
-                solutions.append(list(cmd_seq))
-
-    return solutions
-
-def convert_string(s):
-    # convert action sequences to usable input to our program
-    result = []
-    for char in s:
-        if char == 'K':
-            result.append(' ')
-        else:
-            result.append(char.lower())
-    return result
-
-def main():
-    GOAL_SHAPE = get_shape_from_sequence(convert_string('ZSAZSAR'))
-
-    print("Searching for solutions...")
-    sols = goal_solver(GOAL_SHAPE, max_depth=6)
-    for i, sol in enumerate(sols):
-        print(f"Solution {i+1}: {' -> '.join(sol)}")
-    print(f"Total solutions found: {len(sols)}")
-
-if __name__ == "__main__":
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from bitboard import get_geometry
+from hex_geometry import get_hex_geometry, hex_distance
+from shape_index import DEFAULT_INDEX_PATH, open_index
+
+BOARD_SIZE = 9
+
+geometry = get_hex_geometry(BOARD_SIZE)
+offset_to_axial = geometry.offset_to_axial
+axial_to_offset = geometry.axial_to_offset
+rotate60 = geometry.rotate60
+flip_nw_to_se = geometry.flip_nw_to_se
+flip_ne_to_sw = geometry.flip_ne_to_sw
+
+def check_goal(shapes, goal_shape):
+    return set(shapes[0]) == set(goal_shape)
+
+def get_shape_from_sequence(sequence):
+    shapes = [[]]
+    for cmd in sequence:
+        func = ACTIONS[cmd]
+        shapes = func(shapes)
+    return shapes[0]
+
+def create_center(shapes):
+    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
+    shapes[0].append((cx, cy))
+
+    return shapes
+
+def add_bar(shapes):
+    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
+    bar = [(cx - 1, cy - 1), (cx, cy), (cx + 1, cy)]
+    shapes[0].extend(bar)
+    return shapes
+
+def add_corner(shapes):
+    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
+    corner = [(cx + 1, cy - 1), (cx, cy), (cx, cy + 1)]
+    shapes[0].extend(corner)
+    return shapes
+
+def delete_center(shapes):
+    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
+    for shape in shapes:
+        while (cx, cy) in shape:
+            shape.remove((cx, cy))
+    return shapes
+
+def move_west(shapes):
+    return geometry.transform_shapes(shapes, 'move_west')
+
+def move_northeast(shapes):
+    return geometry.transform_shapes(shapes, 'move_northeast')
+
+def move_southeast(shapes):
+    return geometry.transform_shapes(shapes, 'move_southeast')
+
+def rotate(shapes):
+    return geometry.transform_shapes(shapes, 'rotate60')
+
+def flip(shapes):
+    return geometry.transform_shapes(shapes, 'flip_ne_to_sw')
+
+def reflect(shapes):
+    reflected_shapes = []
+    for shape in shapes:
+        original = shape[:]
+        flipped = geometry.transform(shape, 'flip_ne_to_sw')
+        combined = list(set(original + flipped))
+        reflected_shapes.append(combined)
+    return reflected_shapes
+
+ACTIONS = {
+    'a': create_center,
+    'd': delete_center,
+    'z': add_corner,
+    'x': add_bar,
+    'w': move_west,
+    'e': move_northeast,
+    's': move_southeast,  
+    'f': flip,
+    'r': reflect,
+    ' ': rotate,
+}
+
+def search_geometry(goal_shape, max_depth):
+    # the searches below work on canonical states: the bitboard mask of the occupied cells
+    # duplicated cells never change what an action does (delete_center removes every copy,
+    # reflect de-duplicates, check_goal compares sets), so the multiplicities can be dropped
+    # every added cell starts next to the center and moves one cell per action, so a window
+    # this wide holds every state within max_depth actions of the empty board or of the goal
+    goal_radius = max([hex_distance(*offset_to_axial(x, y)) for x, y in goal_shape], default=0)
+    return get_geometry(goal_radius + max_depth + 1)
+
+def expand_layers(max_depth, geometry, targets=None):
+    # breadth-first expansion over canonical states
+    # layers[d] maps every state reachable in exactly d actions to its back-pointers,
+    # i.e. the (previous state, action) pairs that lead to it from layers[d - 1]
+    # when targets are given, the last layer only keeps the edges that end in one of them,
+    # since nothing else in it can be part of a solution
+    actions = [(cmd, geometry.actions[cmd]) for cmd in ACTIONS.keys()]
+    layers = [{0: []}]
+    for length in range(1, max_depth + 1):
+        last = targets is not None and length == max_depth
+        layers.append(expand_layer(layers[-1], actions, targets if last else None))
+    return layers
+
+def expand_layer(previous_layer, actions, targets=None):
+    # one breadth-first step: the next layer with its back-pointers
+    layer = {}
+    for state in previous_layer:
+        for cmd, action in actions:
+            new_state = action(state)
+            if targets is not None and new_state not in targets:
+                continue
+            if new_state in layer:
+                layer[new_state].append((state, cmd))
+            else:
+                layer[new_state] = [(state, cmd)]
+    return layer
+
+def trace_back(layers, state, length):
+    # list every action sequence that reaches the state in exactly `length` actions
+    if length == 0:
+        return [[]]
+    sequences = []
+    for prev_state, cmd in layers[length][state]:
+        for prefix in trace_back(layers, prev_state, length - 1):
+            sequences.append(prefix + [cmd])
+    return sequences
+
+def collect_solutions(layers, goal, max_depth, shortest_only=False):
+    # every sequence of the breadth-first layers that ends in the goal, shortest first
+    order = {cmd: i for i, cmd in enumerate(ACTIONS.keys())}
+    solutions = []
+
+    for length in range(1, max_depth + 1):
+        if goal not in layers[length]:
+            continue
+        sequences = trace_back(layers, goal, length)
+        # keep the enumerator's itertools.product order
+        sequences.sort(key=lambda seq: [order[cmd] for cmd in seq])
+        solutions.extend(sequences)
+        if shortest_only:
+            break
+
+    return solutions
+
+def bfs_solver(goal_shape, max_depth=7, shortest_only=False):
+    # same solutions as the enumerator, but every distinct state is expanded once per depth
+    geometry = search_geometry(goal_shape, max_depth)
+    goal = geometry.from_cells(goal_shape)
+    layers = expand_layers(max_depth, geometry, {goal})
+    return collect_solutions(layers, goal, max_depth, shortest_only)
+
+def walk_forward(state, depth, useful, actions):
+    # yield, in the enumerator's order, the action sequences that stay inside `useful`
+    # (useful[d] holds the states from which the goal is reached in the remaining actions)
+    if depth == len(useful) - 1:
+        yield []
+        return
+    for cmd, action in actions:
+        new_state = action(state)
+        if new_state in useful[depth + 1]:
+            for suffix in walk_forward(new_state, depth + 1, useful, actions):
+                yield [cmd] + suffix
+
+def iter_solutions(goal_shape, max_depth=7, limit=None, shortest_only=False):
+    # yield the same solutions as goal_solver one at a time, shortest first
+    # layers are only expanded until the current length is exhausted, and within a length the
+    # solutions are walked forward from the empty board, so nothing is listed ahead of time
+    # the search stops after `limit` solutions, or after the shortest length with shortest_only
+    geometry = search_geometry(goal_shape, max_depth)
+    goal = geometry.from_cells(goal_shape)
+    actions = [(cmd, geometry.actions[cmd]) for cmd in ACTIONS.keys()]
+    if limit is not None and limit <= 0:
+        return
+
+    layers = [{0: []}]
+    found = 0
+    for length in range(1, max_depth + 1):
+        # nothing in the last layer but the goal can be part of a solution
+        targets = {goal} if length == max_depth else None
+        layers.append(expand_layer(layers[-1], actions, targets))
+        if goal not in layers[length]:
+            continue
+
+        useful = [set() for _ in range(length + 1)]
+        useful[length].add(goal)
+        for depth in range(length, 0, -1):
+            for state in useful[depth]:
+                useful[depth - 1].update(prev_state for prev_state, _ in layers[depth][state])
+
+        for sequence in walk_forward(0, 0, useful, actions):
+            yield sequence
+            found += 1
+            if limit is not None and found >= limit:
+                return
+        if shortest_only:
+            return
+
+def solve_many(goal_shapes, max_depth=7, shortest_only=False):
+    # answer many goals with a single breadth-first search
+    # the layers do not depend on the goal, so they are built once and every goal is
+    # looked up in them; the last layer keeps the edges into any of the goals
+    # returns a dict from each goal's frozenset of cells to its solutions
+    goal_shapes = list(goal_shapes)
+    geometry = search_geometry([cell for goal_shape in goal_shapes for cell in goal_shape], max_depth)
+    goals = {frozenset(goal_shape): geometry.from_cells(goal_shape) for goal_shape in goal_shapes}
+    layers = expand_layers(max_depth, geometry, set(goals.values()))
+    return {key: collect_solutions(layers, goal, max_depth, shortest_only) for key, goal in goals.items()}
+
+def action_symmetries(geometry):
+    # the symmetries of the hexagon that map every action onto an action, with that relabeling
+    # for such a symmetry g, g(a(S)) == relabel[a](g(S)) for every state S, so states related
+    # by g have the same futures and only one of them needs to be searched
+    # all actions are unions with fixed pieces, deletions and cell maps, so checking the empty
+    # board and every single cell near the center is enough
+    probes = [0] + [1 << bit for bit, (x, y) in geometry.cell_of_bit.items()
+                    if hex_distance(*offset_to_axial(x, y)) < geometry.radius]
+    symmetries = []
+    for g in range(len(geometry.symmetry_tables)):
+        relabel = {}
+        for cmd in ACTIONS.keys():
+            for other in ACTIONS.keys():
+                action, other_action = geometry.actions[cmd], geometry.actions[other]
+                if all(geometry.symmetry(action(state), g) == other_action(geometry.symmetry(state, g))
+                       for state in probes):
+                    relabel[cmd] = other
+                    break
+            else:
+                break
+        else:
+            symmetries.append((g, relabel))
+    return symmetries
+
+def canonical_state(state, geometry, symmetries):
+    # the smallest image of the state under the valid symmetries, and the symmetry giving it
+    return min((geometry.symmetry(state, g), g) for g, _ in symmetries)
+
+def symmetric_solver(goal_shape, max_depth=7, shortest_only=False):
+    # breadth-first search over canonical representatives of the states under the
+    # symmetries returned by action_symmetries; solutions are mapped back to the goal
+    # asked for, so the result is the same as the plain breadth-first search
+    # the current ACTIONS only admit the identity (mirrors turn rotate into its inverse,
+    # 60 and 180 degree turns send the three moves to the missing directions, and 120 degree
+    # turns move the bar), in which case this is exactly bfs_solver
+    geometry = search_geometry(goal_shape, max_depth)
+    symmetries = action_symmetries(geometry)
+    if len(symmetries) == 1:
+        return bfs_solver(goal_shape, max_depth, shortest_only)
+
+    relabels = dict(symmetries)
+    order = {cmd: i for i, cmd in enumerate(ACTIONS.keys())}
+    goal = geometry.from_cells(goal_shape)
+    canonical_goal, _ = canonical_state(goal, geometry, symmetries)
+
+    # layers[d] maps every canonical state to its back-pointers (previous state, action, g),
+    # where the state is g applied to the result of the action on the previous state
+    layers = [{0: []}]
+    for length in range(1, max_depth + 1):
+        layer = {}
+        for state in layers[-1]:
+            for cmd in ACTIONS.keys():
+                new_state, g = canonical_state(geometry.actions[cmd](state), geometry, symmetries)
+                if length == max_depth and new_state != canonical_goal:
+                    continue
+                layer.setdefault(new_state, []).append((state, cmd, g))
+        layers.append(layer)
+
+    def trace(state, g, length):
+        # real action sequences reaching g(state) in exactly `length` actions
+        if length == 0:
+            return [[]]
+        sequences = []
+        for prev_state, cmd, h in layers[length][state]:
+            # g(state) = g(h(cmd(prev_state))) = relabel[cmd](prev_g(prev_state))
+            prev_g = geometry.compose[g][h]
+            real_cmd = relabels[prev_g][cmd]
+            for prefix in trace(prev_state, prev_g, length - 1):
+                sequences.append(prefix + [real_cmd])
+        return sequences
+
+    solutions = []
+    for length in range(1, max_depth + 1):
+        if canonical_goal not in layers[length]:
+            continue
+        # every symmetry taking the canonical goal back to the real goal
+        sequences = set()
+        for g in relabels:
+            if geometry.symmetry(canonical_goal, g) == goal:
+                sequences.update(tuple(seq) for seq in trace(canonical_goal, g, length))
+        sequences = [list(seq) for seq in sequences]
+        # keep the enumerator's itertools.product order
+        sequences.sort(key=lambda seq: [order[cmd] for cmd in seq])
+        solutions.extend(sequences)
+        if shortest_only:
+            break
+
+    return solutions
+
+def expand_backward(goal, max_depth, geometry):
+    # breadth-first expansion from the goal through the preimages of every action
+    # layers[m] maps every state that reaches the goal in exactly m actions to its forward
+    # pointers, i.e. the (action, next state) pairs towards layers[m - 1]
+    # the preimages of the unions, delete_center and reflect are finite (see
+    # BitboardGeometry.preimages), so no solution is lost on the backward side
+    layers = [{goal: []}]
+    for length in range(1, max_depth + 1):
+        layer = {}
+        for state in layers[-1]:
+            for cmd in ACTIONS.keys():
+                for prev_state in geometry.preimages(cmd, state):
+                    if prev_state in layer:
+                        layer[prev_state].append((cmd, state))
+                    else:
+                        layer[prev_state] = [(cmd, state)]
+        layers.append(layer)
+    return layers
+
+def trace_forward(layers, state, length):
+    # list every action sequence that takes the state to the goal in exactly `length` actions
+    if length == 0:
+        return [[]]
+    sequences = []
+    for cmd, next_state in layers[length][state]:
+        for suffix in trace_forward(layers, next_state, length - 1):
+            sequences.append([cmd] + suffix)
+    return sequences
+
+def bidirectional_solver(goal_shape, max_depth=7, forward_depth=None, shortest_only=False):
+    # meet in the middle: a sequence longer than forward_depth splits into its first
+    # forward_depth actions and the rest; prefixes come from a forward search from the empty
+    # board, suffixes from a backward search from the goal through the preimages of every
+    # action, and the two are joined on the states where the forward search stops
+    # sequences of at most forward_depth actions are found by the forward search alone
+    # returns exactly the enumerator's solutions for any forward_depth; the default splits
+    # max_depth in half, so each side only searches about half the depth
+    geometry = search_geometry(goal_shape, max_depth)
+    goal = geometry.from_cells(goal_shape)
+    if forward_depth is None:
+        forward_depth = (max_depth + 1) // 2
+    forward_depth = min(forward_depth, max_depth)
+    backward_depth = max_depth - forward_depth
+    order = {cmd: i for i, cmd in enumerate(ACTIONS.keys())}
+
+    backward = expand_backward(goal, backward_depth, geometry)
+    targets = set()
+    for layer in backward:
+        targets.update(layer)
+    forward = expand_layers(forward_depth, geometry, targets)
+
+    solutions_by_length = {}
+    for length in range(1, forward_depth + 1):
+        if goal in forward[length]:
+            solutions_by_length[length] = trace_back(forward, goal, length)
+    meeting = forward[forward_depth]
+    for suffix_length in range(1, backward_depth + 1):
+        sequences = []
+        for state in backward[suffix_length]:
+            # only states where both searches meet are traced
+            if state not in meeting:
+                continue
+            suffixes = trace_forward(backward, state, suffix_length)
+            for prefix in trace_back(forward, state, forward_depth):
+                for suffix in suffixes:
+                    sequences.append(prefix + suffix)
+        if sequences:
+            solutions_by_length[forward_depth + suffix_length] = sequences
+
+    solutions = []
+    for length in sorted(solutions_by_length):
+        sequences = solutions_by_length[length]
+        # keep the enumerator's itertools.product order
+        sequences.sort(key=lambda seq: [order[cmd] for cmd in seq])
+        solutions.extend(sequences)
+        if shortest_only:
+            break
+
+    return solutions
+
+def enumerate_solver(goal_shape, max_depth=7):
+    action_keys = list(ACTIONS.keys())
+    solutions = []
+
+    for length in range(1, max_depth + 1):
+        for cmd_seq in itertools.product(action_keys, repeat=length):
+            shapes = [[]]
+            for cmd in cmd_seq:
+                func = ACTIONS[cmd]
+                shapes = func(shapes)
+            if check_goal(shapes, goal_shape):
+                solutions.append(list(cmd_seq))
+
+    return solutions
+
+# pruning rules for the enumerator: each one gets the sequence so far, the shapes it leads to
+# and the next action, and returns True when the next action can be skipped
+# every pruned sequence has an equivalent one that is shorter (the skipped action does
+# nothing there) or comes earlier in the same length, so no distinct solution is lost
+
+def rotation_cycle(sequence, shapes, cmd):
+    # six rotations bring the shape back to where it was
+    return cmd == ' ' and sequence[-5:] == [' '] * 5
+
+def double_flip(sequence, shapes, cmd):
+    # two flips cancel each other
+    return cmd == 'f' and sequence[-1:] == ['f']
+
+def move_on_empty(sequence, shapes, cmd):
+    # only the three additions change an empty board
+    return cmd not in ('a', 'z', 'x') and not shapes[0]
+
+def delete_without_center(sequence, shapes, cmd):
+    cx, cy = BOARD_SIZE // 2, BOARD_SIZE // 2
+    return cmd == 'd' and (cx, cy) not in shapes[0]
+
+def reflect_symmetric(sequence, shapes, cmd):
+    # reflecting a shape that is its own mirror image changes nothing
+    return cmd == 'r' and set(geometry.transform(shapes[0], 'flip_ne_to_sw')) == set(shapes[0])
+
+def commuting_order(sequence, shapes, cmd):
+    # the additions commute with each other, and so do the three moves, so only the
+    # ordering that follows ACTIONS is kept within a run of either
+    if not sequence:
+        return False
+    order = list(ACTIONS.keys())
+    for group in (('a', 'z', 'x'), ('w', 'e', 's')):
+        if cmd in group and sequence[-1] in group:
+            return order.index(sequence[-1]) > order.index(cmd)
+    return False
+
+PRUNING_RULES = {
+    'rotation_cycle': rotation_cycle,
+    'double_flip': double_flip,
+    'move_on_empty': move_on_empty,
+    'delete_without_center': delete_without_center,
+    'reflect_symmetric': reflect_symmetric,
+}
+
+# rules that keep one representative of each class of reordered sequences
+CANONICAL_RULES = {
+    'commuting_order': commuting_order,
+}
+
+def pruned_solver(goal_shape, max_depth=7, rules=None, canonical=False, stats=None):
+    # the enumerator as a depth-first walk over prefixes, skipping every sequence that
+    # starts with a pruned prefix
+    # rules picks the PRUNING_RULES to use (all of them by default); canonical adds the
+    # CANONICAL_RULES, so only one ordering of commuting actions is returned
+    # when a stats dict is given, it receives the number of sequences each rule skipped,
+    # out of the ones the plain enumerator would run
+    if rules is None:
+        rules = list(PRUNING_RULES.keys())
+    active = [(name, PRUNING_RULES[name]) for name in rules]
+    if canonical:
+        active += list(CANONICAL_RULES.items())
+    if stats is None:
+        stats = {}
+    for name, _ in active:
+        stats[name] = 0
+
+    action_keys = list(ACTIONS.keys())
+    # number of sequences of length at most max_depth that start with a given prefix
+    subtree_size = [sum(len(action_keys) ** i for i in range(max_depth - length + 1))
+                    for length in range(max_depth + 1)]
+    solutions_by_length = {length: [] for length in range(1, max_depth + 1)}
+
+    def walk(sequence, shapes):
+        for cmd in action_keys:
+            pruned_by = next((name for name, rule in active if rule(sequence, shapes, cmd)), None)
+            new_sequence = sequence + [cmd]
+            if pruned_by is not None and sequence:
+                stats[pruned_by] += subtree_size[len(new_sequence)]
+                continue
+            new_shapes = ACTIONS[cmd]([list(shape) for shape in shapes])
+            if check_goal(new_shapes, goal_shape):
+                solutions_by_length[len(new_sequence)].append(new_sequence)
+            if pruned_by is not None:
+                # a single no-op would reduce to the empty program, which is never returned,
+                # so it is still checked on its own
+                stats[pruned_by] += subtree_size[len(new_sequence)] - 1
+                continue
+            if len(new_sequence) < max_depth:
+                walk(new_sequence, new_shapes)
+
+    walk([], [[]])
+
+    solutions = []
+    for length in range(1, max_depth + 1):
+        solutions.extend(solutions_by_length[length])
+    return solutions
+
+def solve_prefix(goal_shape, prefix, max_depth):
+    # enumerate every sequence that starts with the prefix, grouped by length
+    # the prefix is replayed once and each suffix starts from a copy of its shapes
+    action_keys = list(ACTIONS.keys())
+    start = [[]]
+    for cmd in prefix:
+        start = ACTIONS[cmd](start)
+
+    solutions_by_length = {}
+    for length in range(len(prefix), max_depth + 1):
+        solutions = []
+        for suffix in itertools.product(action_keys, repeat=length - len(prefix)):
+            shapes = [list(shape) for shape in start]
+            for cmd in suffix:
+                shapes = ACTIONS[cmd](shapes)
+            if check_goal(shapes, goal_shape):
+                solutions.append(list(prefix) + list(suffix))
+        solutions_by_length[length] = solutions
+    return solutions_by_length
+
+def parallel_solver(goal_shape, max_depth=7, workers=None, chunk_prefix_len=2):
+    # the enumerator sharded by action prefix over a process pool (workers=None uses every core)
+    # sequences shorter than the prefixes are few and are enumerated here directly
+    # executor.map hands the shards back in prefix order, which keeps the merged list
+    # in the enumerator's itertools.product order
+    action_keys = list(ACTIONS.keys())
+    prefix_len = max(1, min(chunk_prefix_len, max_depth))
+    solutions = enumerate_solver(goal_shape, prefix_len - 1)
+    prefixes = list(itertools.product(action_keys, repeat=prefix_len))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # a few batches per worker keeps the pool busy without paying for one round trip per prefix
+    chunksize = max(1, len(prefixes) // (4 * workers))
+
+    solutions_by_length = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shards = executor.map(solve_prefix, itertools.repeat(goal_shape), prefixes, itertools.repeat(max_depth),
+                              chunksize=chunksize)
+        for shard in shards:
+            for length, found in shard.items():
+                solutions_by_length.setdefault(length, []).extend(found)
+
+    for length in sorted(solutions_by_length):
+        solutions.extend(solutions_by_length[length])
+    return solutions
+
+def index_solver(goal_shape, max_depth=7, index_path=DEFAULT_INDEX_PATH):
+    # only the shortest solutions (the index stores nothing else), looked up in a prebuilt
+    # shape index (see shape_index.py); equal to bfs_solver(..., shortest_only=True)
+    # the index holds every shape reachable within its depth, so a goal missing from it can
+    # only need a search when max_depth goes beyond that depth
+    if os.path.exists(index_path):
+        index = open_index(index_path)
+        found = index.lookup(goal_shape)
+        if found is not None:
+            length, programs = found
+            return programs if length <= max_depth else []
+        if max_depth <= index.depth:
+            return []
+    return bfs_solver(goal_shape, max_depth, shortest_only=True)
+
+SOLVERS = {
+    'enumerate': enumerate_solver,
+    'bfs': bfs_solver,
+    'bidirectional': bidirectional_solver,
+    'parallel': parallel_solver,
+    'index': index_solver,
+    'symmetric': symmetric_solver,
+    'pruned': pruned_solver,
+}
+
+def goal_solver(goal_shape, max_depth=7, method='enumerate', **kwargs):
+    # method chooses the search strategy
+    # enumerate, bfs, bidirectional, parallel and symmetric all return the enumerator's
+    # solution list; the others answer a narrower question:
+    #   index   only the shortest solutions, like shortest_only=True on the others
+    #   pruned  the solutions minus the sequences its rules skip as redundant
+    return SOLVERS[method](goal_shape, max_depth=max_depth, **kwargs)
+
+def convert_string(s):
+    # convert action sequences to usable input to our program
+    result = []
+    for char in s:
+        if char == 'K':
+            result.append(' ')
+        else:
+            result.append(char.lower())
+    return result
+
+def main():
+    GOAL_SHAPE = get_shape_from_sequence(convert_string('ZSAZSAR'))
+
+    print("Searching for solutions...")
+    count = 0
+    for sol in iter_solutions(GOAL_SHAPE, max_depth=6):
+        count += 1
+        print(f"Solution {count}: {' -> '.join(sol)}")
+    print(f"Total solutions found: {count}")
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
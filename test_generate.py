@@ -0,0 +1,41 @@
+import math
+from collections import Counter
+
+import generate
+
+# S -> S S keeps the sentences growing past max_length, so the length penalty fires often
+GRAMMAR = """
+S -> S S [0.5] | A [0.5]
+A -> 'a' [0.5] | 'a' 'b' 'c' [0.5]
+"""
+LONGEST_RHS = 3
+SAMPLES = 200000
+
+def sample_frequencies(rules, max_length):
+    corpus = generate.generate_corpus(rules, SAMPLES, max_length=max_length, seed=0)
+    return Counter(tuple(sentence) for sentence in corpus)
+
+def within(count, probability, sigmas=5):
+    return abs(count - SAMPLES * probability) <= sigmas * math.sqrt(SAMPLES * probability * (1 - probability)) + 1
+
+def test_string_distribution_matches_sampler_below_penalty_bound():
+    rules = generate.parse_grammar_string(GRAMMAR)
+    max_length = 8
+    bound = max_length - LONGEST_RHS
+    exact = generate.string_distribution(rules, bound)
+    counts = sample_frequencies(rules, max_length)
+    assert exact
+    for string, probability in exact.items():
+        assert within(counts[string], probability), string
+    short = sum(count for string, count in counts.items() if len(string) <= bound)
+    assert within(short, sum(exact.values()))
+
+def test_string_distribution_is_unpenalised_above_bound():
+    # the penalty renormalises the alternatives that still fit, so a string shorter than
+    # max_length but longer than the bound is more likely under the sampler than the PCFG
+    rules = generate.parse_grammar_string(GRAMMAR)
+    exact = generate.string_distribution(rules, 4)
+    assert exact[('a', 'a', 'a')] == 0.0078125
+    counts = sample_frequencies(rules, 4)
+    assert not within(counts[('a', 'a', 'a')], exact[('a', 'a', 'a')])
+    assert counts[('a', 'a', 'a')] / SAMPLES > 0.012
@@ -0,0 +1,127 @@
+import random
+from collections import Counter
+
+import pytest
+
+import solver
+from bitboard import HexShape
+from shape_index import build_index
+
+# with the full ACTIONS only the identity symmetry is valid, so symmetric_solver is plain
+# bfs_solver; these restricted action sets keep larger symmetry groups and exercise the
+# canonicalised search against the unpruned searches
+SYMMETRIC_ACTION_SETS = {
+    'C6': 'ad ',
+    'C3': 'adwes ',
+    'D3': 'adwes',
+    'C2': 'adxfr ',
+    'mirror': 'adzxwesfr',
+}
+
+# goals as action sequences, so each one is reachable with the actions it uses
+GOALS = {
+    'C6': ['A', 'AK', 'AD'],
+    'C3': ['AW', 'AWE', 'ASKA', 'AWKS'],
+    'D3': ['AW', 'AWES', 'AEWA'],
+    'C2': ['X', 'XF', 'XKA', 'XR', 'AXKF'],
+    'mirror': ['Z', 'ZF', 'ZSA', 'XWZ', 'ZRE'],
+}
+
+DEPTHS = {'C6': 5, 'C3': 5, 'D3': 5, 'C2': 5, 'mirror': 4}
+
+def restrict_actions(monkeypatch, cmds):
+    actions = {cmd: solver.ACTIONS[cmd] for cmd in cmds}
+    monkeypatch.setattr(solver, 'ACTIONS', actions)
+
+@pytest.mark.parametrize('group', sorted(SYMMETRIC_ACTION_SETS))
+def test_action_sets_keep_symmetries(monkeypatch, group):
+    restrict_actions(monkeypatch, SYMMETRIC_ACTION_SETS[group])
+    geometry = solver.get_geometry(6)
+    assert len(solver.action_symmetries(geometry)) > 1
+
+@pytest.mark.parametrize('group,sequence', [(group, sequence) for group in sorted(GOALS) for sequence in GOALS[group]])
+def test_symmetric_solver_matches_unpruned_search(monkeypatch, group, sequence):
+    restrict_actions(monkeypatch, SYMMETRIC_ACTION_SETS[group])
+    goal = solver.get_shape_from_sequence(solver.convert_string(sequence))
+    max_depth = DEPTHS[group]
+
+    symmetric = solver.symmetric_solver(goal, max_depth)
+    assert symmetric
+    assert symmetric == solver.bfs_solver(goal, max_depth)
+    assert symmetric == solver.enumerate_solver(goal, max_depth)
+    assert solver.symmetric_solver(goal, max_depth, shortest_only=True) == solver.bfs_solver(goal, max_depth, shortest_only=True)
+
+def test_symmetric_solver_with_all_actions():
+    goal = solver.get_shape_from_sequence(solver.convert_string('ZSA'))
+    assert solver.symmetric_solver(goal, 4) == solver.enumerate_solver(goal, 4)
+
+# goals as action sequences for the searches over the full ACTIONS; the last one needs seven
+# actions, so it has no solution at SEARCH_DEPTH
+SOLVER_GOALS = ['A', 'X', 'ZF', 'ZR', 'ZSA', 'XWZ', 'AWA', 'XDF', 'ZSAZSAR']
+SEARCH_DEPTH = 4
+
+def shape(sequence):
+    return solver.get_shape_from_sequence(solver.convert_string(sequence))
+
+@pytest.mark.parametrize('sequence', SOLVER_GOALS)
+def test_bidirectional_solver_matches_enumerator_for_every_split(sequence):
+    goal = shape(sequence)
+    expected = solver.enumerate_solver(goal, SEARCH_DEPTH)
+    for forward_depth in range(SEARCH_DEPTH + 2):
+        assert solver.bidirectional_solver(goal, SEARCH_DEPTH, forward_depth=forward_depth) == expected, forward_depth
+
+@pytest.fixture(scope='module')
+def index_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('index') / 'shape_index.bin')
+    build_index(path, SEARCH_DEPTH)
+    return path
+
+def shortest(solutions):
+    length = min((len(solution) for solution in solutions), default=0)
+    return [solution for solution in solutions if len(solution) == length]
+
+@pytest.mark.parametrize('sequence', SOLVER_GOALS)
+def test_solvers_match_enumerator(index_path, sequence):
+    goal = shape(sequence)
+    expected = solver.enumerate_solver(goal, SEARCH_DEPTH)
+    assert solver.bfs_solver(goal, SEARCH_DEPTH) == expected
+    assert solver.parallel_solver(goal, SEARCH_DEPTH, workers=2) == expected
+    assert solver.solve_many([goal, shape('A')], SEARCH_DEPTH)[frozenset(goal)] == expected
+    assert list(solver.iter_solutions(goal, SEARCH_DEPTH)) == expected
+    assert solver.index_solver(goal, SEARCH_DEPTH, index_path=index_path) == solver.bfs_solver(goal, SEARCH_DEPTH, shortest_only=True)
+    assert solver.bfs_solver(goal, SEARCH_DEPTH, shortest_only=True) == shortest(expected)
+    # pruning only skips redundant sequences, so every shortest solution survives it
+    pruned = solver.pruned_solver(goal, SEARCH_DEPTH)
+    assert all(solution in expected for solution in pruned)
+    assert shortest(pruned) == shortest(expected)
+
+def test_bidirectional_solver_finds_long_solutions():
+    # a split where the backward half has to go through the preimages of the lossy actions
+    goal = shape('ZSAZSAR')
+    solutions = solver.bidirectional_solver(goal, 8, forward_depth=4)
+    assert solutions
+    assert solutions == solver.bfs_solver(goal, 8)
+
+def hex_shape_matches_list_actions(sequence):
+    # the HexShape after every action holds the list version's cells, with their duplicates
+    shapes = [[]]
+    hex_shape = HexShape()
+    for cmd in sequence:
+        shapes = solver.ACTIONS[cmd]([shape[:] for shape in shapes])
+        hex_shape = hex_shape.apply(cmd)
+        if Counter(hex_shape.cells()) != Counter(shapes[0]):
+            return False
+        if HexShape.from_cells(shapes[0]) != hex_shape:
+            return False
+    return True
+
+@pytest.mark.parametrize('sequence', ['XA', 'AXZ', 'XAD', 'XAR', 'ZAK', 'XAWF', 'AXZSAZR'])
+def test_hex_shape_keeps_duplicates(sequence):
+    assert hex_shape_matches_list_actions(solver.convert_string(sequence))
+
+def test_hex_shape_matches_list_actions_on_random_sequences():
+    rng = random.Random(0)
+    cmds = sorted(solver.ACTIONS)
+    for _ in range(1000):
+        sequence = [rng.choice(cmds) for _ in range(rng.randint(1, 8))]
+        assert hex_shape_matches_list_actions(sequence), sequence